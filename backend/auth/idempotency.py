@@ -0,0 +1,82 @@
+"""
+Business: Ключи идемпотентности для POST-запросов (заголовок Idempotency-Key)
+Args: курсор RealDictCursor, область ключа (scope) и сам ключ
+Returns: сохранённый HTTP response для повтора или None, если запрос нужно выполнить
+"""
+
+import os
+import random
+from typing import Any, Dict, Optional
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+CLEANUP_PROBABILITY = 0.01
+CLEANUP_BATCH_SIZE = 500
+
+
+def get_key(event: Dict[str, Any]) -> Optional[str]:
+    """Ключ из заголовка Idempotency-Key; слишком длинный ключ игнорируется"""
+    headers = event.get('headers') or {}
+    key = headers.get('Idempotency-Key') or headers.get('idempotency-key')
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return None
+    return key
+
+
+def _cached_response(row) -> Dict[str, Any]:
+    return {
+        'statusCode': row['status_code'],
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Idempotent-Replayed': 'true'
+        },
+        'body': row['body'],
+        'isBase64Encoded': False
+    }
+
+
+def replay(cursor, scope: str, key: str) -> Optional[Dict[str, Any]]:
+    """Сохранённый ответ одним поиском по первичному ключу"""
+    cursor.execute("""
+        SELECT status_code, body
+        FROM idempotency_keys
+        WHERE scope = %s AND key = %s AND expires_at > CURRENT_TIMESTAMP AND status_code IS NOT NULL
+    """, (scope, key))
+    row = cursor.fetchone()
+    return _cached_response(row) if row else None
+
+
+def reserve(cursor, scope: str, key: str) -> Optional[Dict[str, Any]]:
+    """Занять ключ в текущей транзакции. Параллельный запрос с тем же ключом ждёт её
+    завершения и получает сохранённый ответ; при откате ключ освобождается.
+    None - ключ наш, запрос нужно выполнить."""
+    cursor.execute("""
+        INSERT INTO idempotency_keys (scope, key, expires_at)
+        VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+        ON CONFLICT (scope, key) DO UPDATE
+        SET status_code = NULL, body = NULL, created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+        RETURNING key
+    """, (scope, key, IDEMPOTENCY_TTL_SECONDS))
+    if cursor.fetchone():
+        return None
+    return replay(cursor, scope, key)
+
+
+def remember(cursor, scope: str, key: str, response: Dict[str, Any]):
+    """Сохранить ответ под занятым ключом до коммита; изредка вычищает истёкшие ключи"""
+    cursor.execute("""
+        UPDATE idempotency_keys
+        SET status_code = %s, body = %s
+        WHERE scope = %s AND key = %s
+    """, (response['statusCode'], response['body'], scope, key))
+    if random.random() < CLEANUP_PROBABILITY:
+        cursor.execute("""
+            DELETE FROM idempotency_keys
+            WHERE (scope, key) IN (
+                SELECT scope, key FROM idempotency_keys
+                WHERE expires_at <= CURRENT_TIMESTAMP
+                LIMIT %s
+            )
+        """, (CLEANUP_BATCH_SIZE,))
@@ -1,237 +1,169 @@
 """
 Business: Регистрация и авторизация пользователей с реферальной системой
-Args: event - dict с httpMethod, body (email, password, username, referral_code)
-Returns: HTTP response с токеном и данными пользователя
+Args: event - dict с httpMethod, body (action: register / login / logout; email, password, username, referral_code),
+      headers (Idempotency-Key; X-Auth-Token для logout)
+Returns: HTTP response с токеном сессии и данными пользователя
 """
 
-import json
-import os
 import hashlib
-import secrets
-import string
 from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from runtime import Request, Router, dumps, error, loads, respond
+import idempotency
+import sessions
 
-DATABASE_URL = os.environ.get('DATABASE_URL')
 
-REFERRAL_LEVELS = {
-    1: 0.10,
-    2: 0.05,
-    3: 0.03,
-    4: 0.02,
-    5: 0.01
-}
+def hash_password(password: str) -> str:
+    """Хеширование пароля"""
+    return hashlib.sha256(password.encode()).hexdigest()
 
 
-def generate_referral_code(length=8):
-    """Генерация уникального реферального кода"""
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(secrets.choice(chars) for _ in range(length))
+def register_user(cursor, email: str, password_hash: str, username: str, referral_code_input: str):
+    """Регистрация одним запросом: поиск реферера, код из id, INSERT, строки referral_closure
+    и событие для начислений.
+    Возвращает строку нового пользователя или None, если email уже занят."""
+    cursor.execute("""
+        WITH new_id AS (
+            SELECT nextval(pg_get_serial_sequence('users', 'id')) AS id
+        ),
+        new_user AS (
+            INSERT INTO users (id, email, password_hash, username, referral_code, referred_by_id)
+            SELECT new_id.id, %(email)s, %(password_hash)s, %(username)s, referral_code_from_id(new_id.id),
+                   (SELECT id FROM users WHERE referral_code = %(referral_code)s)
+            FROM new_id
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id, email, username, referral_code, balance, total_earned, is_admin, referred_by_id
+        ),
+        event AS (
+            INSERT INTO referral_outbox (event_type, user_id, referred_by_id)
+            SELECT 'user_registered', id, referred_by_id FROM new_user
+        ),
+        closure AS (
+            INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+            SELECT id, id, 0 FROM new_user
+            UNION ALL
+            SELECT rc.ancestor_id, new_user.id, rc.depth + 1
+            FROM new_user
+            JOIN referral_closure rc ON rc.descendant_id = new_user.referred_by_id AND rc.depth < 5
+        )
+        SELECT id, email, username, referral_code, balance, total_earned, is_admin FROM new_user
+    """, {
+        'email': email,
+        'password_hash': password_hash,
+        'username': username,
+        'referral_code': referral_code_input or None,
+    })
+    user = cursor.fetchone()
+    return dict(user) if user else None
 
 
-def hash_password(password: str) -> str:
-    """Хеширование пароля"""
-    return hashlib.sha256(password.encode()).hexdigest()
+def replay_registration(request: Request, cached: Dict[str, Any], email: str, password_hash: str) -> Dict[str, Any]:
+    """Повтор регистрации по Idempotency-Key. Снимок ответа хранится без токена: при совпадении
+    пароля выдаётся новая сессия, иначе 401 - ключ и email не дают входа без пароля."""
+    if cached['statusCode'] != 200:
+        return cached
+    
+    cursor = request.cursor
+    cursor.execute("SELECT id, is_admin FROM users WHERE email = %s AND password_hash = %s", (email, password_hash))
+    user = cursor.fetchone()
+    if not user:
+        return error(401, 'Неверный email или пароль')
+    
+    payload = loads(cached['body'])
+    payload['token'] = sessions.issue(cursor, user['id'], user['is_admin'])
+    request.conn.commit()
+    
+    return {**cached, 'body': dumps(payload)}
+
 
+router = Router('Content-Type, X-Auth-Token, Authorization, Idempotency-Key', name='auth')
 
-def create_referral_chain(conn, new_user_id: int, referred_by_id: int, registration_bonus: float = 100.0):
-    """Создание цепочки реферальных начислений (5 уровней)"""
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    current_referrer_id = referred_by_id
-    level = 1
-    
-    while current_referrer_id and level <= 5:
-        percentage = REFERRAL_LEVELS[level]
-        bonus_amount = registration_bonus * percentage
-        
-        cursor.execute("""
-            INSERT INTO referral_earnings (user_id, referred_user_id, level, amount, percentage)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (current_referrer_id, new_user_id, level, bonus_amount, percentage * 100))
-        
-        cursor.execute("""
-            UPDATE users 
-            SET balance = balance + %s, total_earned = total_earned + %s
-            WHERE id = %s
-        """, (bonus_amount, bonus_amount, current_referrer_id))
-        
-        cursor.execute("""
-            INSERT INTO transactions (user_id, type, amount, description)
-            VALUES (%s, 'referral', %s, %s)
-        """, (current_referrer_id, bonus_amount, f'Реферальный бонус {level} уровня от нового пользователя'))
-        
-        cursor.execute("SELECT referred_by_id FROM users WHERE id = %s", (current_referrer_id,))
-        result = cursor.fetchone()
-        current_referrer_id = result['referred_by_id'] if result else None
-        level += 1
+
+@router.route('POST', 'register')
+def register(request: Request) -> Dict[str, Any]:
+    body = request.body
+    email = body.get('email', '').strip()
+    password = body.get('password', '').strip()
+    username = body.get('username', '').strip()
+    referral_code_input = body.get('referral_code', '').strip()
+    
+    if not email or not password or not username:
+        return error(400, 'Заполните все поля')
+    
+    cursor = request.cursor
+    password_hash = hash_password(password)
+    idempotency_key = idempotency.get_key(request.event)
+    idempotency_scope = f'register:{email}'
+    if idempotency_key:
+        cached = idempotency.replay(cursor, idempotency_scope, idempotency_key) \
+            or idempotency.reserve(cursor, idempotency_scope, idempotency_key)
+        if cached:
+            return replay_registration(request, cached, email, password_hash)
+    
+    user = register_user(cursor, email, password_hash, username, referral_code_input)
+    
+    if not user:
+        return error(400, 'Email уже зарегистрирован')
+    
+    token = sessions.issue(cursor, user['id'], user['is_admin'])
+    
+    if idempotency_key:
+        idempotency.remember(cursor, idempotency_scope, idempotency_key, respond(200, {
+            'success': True,
+            'user': user
+        }))
+    request.conn.commit()
+    
+    return respond(200, {
+        'success': True,
+        'token': token,
+        'user': user
+    })
+
+
+@router.route('POST', 'login')
+def login(request: Request) -> Dict[str, Any]:
+    body = request.body
+    email = body.get('email', '').strip()
+    password = body.get('password', '').strip()
+    
+    if not email or not password:
+        return error(400, 'Заполните все поля')
+    
+    cursor = request.cursor
+    cursor.execute("""
+        SELECT u.id, u.email, u.username, u.referral_code, b.balance, b.total_earned, u.is_admin
+        FROM users u
+        JOIN user_balances b ON b.user_id = u.id
+        WHERE u.email = %s AND u.password_hash = %s
+    """, (email, hash_password(password)))
+    
+    user = cursor.fetchone()
+    
+    if not user:
+        return error(401, 'Неверный email или пароль')
+    
+    token = sessions.issue(cursor, user['id'], user['is_admin'])
+    request.conn.commit()
+    
+    return respond(200, {
+        'success': True,
+        'token': token,
+        'user': user
+    })
+
+
+@router.route('POST', 'logout')
+def logout(request: Request) -> Dict[str, Any]:
+    token = sessions.get_token(request.headers)
+    
+    if not token:
+        return error(401, 'Требуется авторизация')
+    
+    revoked = sessions.revoke(request.cursor, token)
+    request.conn.commit()
+    
+    return respond(200, {'success': True, 'revoked': revoked})
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'register':
-                email = body.get('email', '').strip()
-                password = body.get('password', '').strip()
-                username = body.get('username', '').strip()
-                referral_code_input = body.get('referral_code', '').strip()
-                
-                if not email or not password or not username:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Заполните все поля'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-                if cursor.fetchone():
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email уже зарегистрирован'}),
-                        'isBase64Encoded': False
-                    }
-                
-                referred_by_id = None
-                if referral_code_input:
-                    cursor.execute("SELECT id FROM users WHERE referral_code = %s", (referral_code_input,))
-                    referrer = cursor.fetchone()
-                    if referrer:
-                        referred_by_id = referrer['id']
-                
-                password_hash = hash_password(password)
-                new_referral_code = generate_referral_code()
-                
-                while True:
-                    cursor.execute("SELECT id FROM users WHERE referral_code = %s", (new_referral_code,))
-                    if not cursor.fetchone():
-                        break
-                    new_referral_code = generate_referral_code()
-                
-                cursor.execute("""
-                    INSERT INTO users (email, password_hash, username, referral_code, referred_by_id)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id, email, username, referral_code, balance, total_earned, is_admin
-                """, (email, password_hash, username, new_referral_code, referred_by_id))
-                
-                user = cursor.fetchone()
-                
-                if referred_by_id:
-                    create_referral_chain(conn, user['id'], referred_by_id)
-                
-                conn.commit()
-                
-                token = secrets.token_urlsafe(32)
-                
-                user_data = dict(user)
-                user_data['balance'] = float(user_data['balance'])
-                user_data['total_earned'] = float(user_data['total_earned'])
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'token': token,
-                        'user': user_data
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'login':
-                email = body.get('email', '').strip()
-                password = body.get('password', '').strip()
-                
-                if not email or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Заполните все поля'}),
-                        'isBase64Encoded': False
-                    }
-                
-                password_hash = hash_password(password)
-                
-                cursor.execute("""
-                    SELECT id, email, username, referral_code, balance, total_earned, is_admin
-                    FROM users 
-                    WHERE email = %s AND password_hash = %s
-                """, (email, password_hash))
-                
-                user = cursor.fetchone()
-                
-                if not user:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный email или пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
-                token = secrets.token_urlsafe(32)
-                
-                user_data = dict(user)
-                user_data['balance'] = float(user_data['balance'])
-                user_data['total_earned'] = float(user_data['total_earned'])
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'token': token,
-                        'user': user_data
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неизвестное действие'}),
-                    'isBase64Encoded': False
-                }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+    return router(event, context)
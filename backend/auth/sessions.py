@@ -0,0 +1,141 @@
+"""
+Business: Сессии пользователей: выдача токена при входе и регистрации, проверка и отзыв
+Args: курсор RealDictCursor (для проверки - функция, возвращающая его), заголовки запроса
+      (X-Auth-Token или Authorization: Bearer)
+Returns: сессия {'user_id', 'is_admin'} или None; в базе хранится только SHA-256 токена,
+         проверенные сессии кешируются в контейнере, поэтому отзыв доходит до других
+         контейнеров не позже чем через SESSION_CACHE_TTL_SECONDS
+"""
+
+import hashlib
+import os
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from runtime import error
+
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', str(30 * 86400)))
+SESSION_CACHE_TTL_SECONDS = float(os.environ.get('SESSION_CACHE_TTL_SECONDS', '60'))
+SESSION_CACHE_MAX_SIZE = int(os.environ.get('SESSION_CACHE_MAX_SIZE', '10000'))
+CLEANUP_PROBABILITY = 0.01
+CLEANUP_BATCH_SIZE = 500
+
+
+class SessionCache:
+    """Ограниченный LRU-кеш проверенных сессий; запись живёт не дольше ttl и не дольше самой сессии"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token_hash: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            session, valid_until = entry
+            if valid_until <= now:
+                del self._entries[token_hash]
+                return None
+            self._entries.move_to_end(token_hash)
+            return session
+
+    def put(self, token_hash: str, session: Dict[str, Any], expires_in: float):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        valid_until = time.monotonic() + min(self.ttl, expires_in)
+        with self._lock:
+            self._entries[token_hash] = (session, valid_until)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, token_hash: str):
+        with self._lock:
+            self._entries.pop(token_hash, None)
+
+
+_cache = SessionCache(SESSION_CACHE_MAX_SIZE, SESSION_CACHE_TTL_SECONDS)
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_token(headers: Dict[str, Any]) -> Optional[str]:
+    """Токен из X-Auth-Token или Authorization: Bearer"""
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if not token:
+        authorization = headers.get('Authorization') or headers.get('authorization') or ''
+        if authorization.startswith('Bearer '):
+            token = authorization[len('Bearer '):].strip()
+    return token or None
+
+
+def issue(cursor, user_id: int, is_admin: bool) -> str:
+    """Создать сессию в текущей транзакции и вернуть токен; изредка вычищает истёкшие сессии"""
+    token = secrets.token_urlsafe(32)
+    cursor.execute("""
+        INSERT INTO sessions (token_hash, user_id, is_admin, expires_at)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+    """, (hash_token(token), user_id, bool(is_admin), SESSION_TTL_SECONDS))
+    if random.random() < CLEANUP_PROBABILITY:
+        cursor.execute("""
+            DELETE FROM sessions
+            WHERE token_hash IN (
+                SELECT token_hash FROM sessions
+                WHERE expires_at <= CURRENT_TIMESTAMP
+                LIMIT %s
+            )
+        """, (CLEANUP_BATCH_SIZE,))
+    return token
+
+
+def revoke(cursor, token: str) -> bool:
+    """Удалить сессию; в остальных контейнерах она перестанет действовать по истечении кеша"""
+    token_hash = hash_token(token)
+    cursor.execute("DELETE FROM sessions WHERE token_hash = %s", (token_hash,))
+    _cache.discard(token_hash)
+    return cursor.rowcount > 0
+
+
+def authenticate(get_cursor: Callable[[], Any], headers: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Сессия по токену из заголовков: из кеша контейнера, иначе одним поиском по первичному ключу.
+    get_cursor вызывается только при промахе кеша, поэтому запрос без токена или с сессией
+    из кеша не берёт соединение из пула"""
+    token = get_token(headers)
+    if not token:
+        return None
+    token_hash = hash_token(token)
+    session = _cache.get(token_hash)
+    if session is not None:
+        return session
+    
+    cursor = get_cursor()
+    cursor.execute("""
+        SELECT user_id, is_admin, EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP) AS expires_in
+        FROM sessions
+        WHERE token_hash = %s AND expires_at > CURRENT_TIMESTAMP
+    """, (token_hash,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    session = {'user_id': row['user_id'], 'is_admin': row['is_admin']}
+    _cache.put(token_hash, session, float(row['expires_in']))
+    return session
+
+
+def require(request, admin: bool = False) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Сессия запроса runtime.Request и None, либо None и готовый ответ 401/403"""
+    session = authenticate(lambda: request.cursor, request.headers)
+    if not session:
+        return None, error(401, 'Требуется авторизация')
+    if admin and not session['is_admin']:
+        return None, error(403, 'Доступ запрещён')
+    return session, None
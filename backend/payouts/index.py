@@ -0,0 +1,200 @@
+"""
+Business: Пакетная обработка очереди регистраций и начисление реферальных бонусов (5 уровней)
+Args: event - dict (вызов по таймеру), может содержать batch_size и max_batches в body; HTTP-вызов
+      (event с httpMethod) требует заголовок X-Payouts-Secret, равный переменной PAYOUTS_SECRET
+Returns: HTTP response с количеством обработанных событий
+"""
+
+import argparse
+import hmac
+import json
+import os
+import time
+from typing import Dict, Any
+from db import connection
+from runtime import error, loads, respond
+
+REFERRAL_LEVELS = {
+    1: 0.10,
+    2: 0.05,
+    3: 0.03,
+    4: 0.02,
+    5: 0.01
+}
+
+REGISTRATION_BONUS = 100.0
+DEFAULT_BATCH_SIZE = 500
+MAX_BATCH_SIZE = 5000
+DEFAULT_MAX_BATCHES = 20
+MAX_MAX_BATCHES = 100
+PAYOUTS_SECRET = os.environ.get('PAYOUTS_SECRET', '')
+
+
+def process_batch(conn, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Обработать до batch_size событий одним запросом; возвращает число обработанных.
+    Начисления по всем событиям пакета группируются по получателю и пишутся
+    в balance_deltas, не блокируя строки users. Повторная обработка безопасна: уже
+    начисленные (referred_user_id, level) пропускаются уникальным индексом."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        WITH events AS (
+            SELECT id, user_id, referred_by_id
+            FROM referral_outbox
+            WHERE processed_at IS NULL AND event_type = 'user_registered'
+            ORDER BY id
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        ),
+        chain AS (
+            SELECT events.user_id AS new_user_id, rc.ancestor_id AS user_id, rc.depth AS level
+            FROM events
+            JOIN referral_closure rc ON rc.descendant_id = events.user_id
+            WHERE rc.depth BETWEEN 1 AND %(max_level)s
+        ),
+        rates AS (
+            SELECT * FROM unnest(%(levels)s::int[], %(rates)s::numeric[]) AS r(level, rate)
+        ),
+        earnings AS (
+            INSERT INTO referral_earnings (user_id, referred_user_id, level, amount, percentage)
+            SELECT chain.user_id, chain.new_user_id, chain.level, %(bonus)s::numeric * rates.rate, rates.rate * 100
+            FROM chain
+            JOIN rates ON rates.level = chain.level
+            ON CONFLICT (referred_user_id, level) DO NOTHING
+            RETURNING user_id, level, amount
+        ),
+        balances AS (
+            INSERT INTO balance_deltas (user_id, balance_delta, earned_delta)
+            SELECT user_id, SUM(amount), SUM(amount)
+            FROM earnings
+            GROUP BY user_id
+        ),
+        stats AS (
+            INSERT INTO referral_stats (user_id, level, count, earned)
+            SELECT user_id, level, COUNT(*), SUM(amount)
+            FROM earnings
+            GROUP BY user_id, level
+            ON CONFLICT (user_id, level) DO UPDATE
+            SET count = referral_stats.count + EXCLUDED.count,
+                earned = referral_stats.earned + EXCLUDED.earned
+        ),
+        ledger AS (
+            INSERT INTO transactions (user_id, type, amount, description)
+            SELECT user_id, 'referral', amount, 'Реферальный бонус ' || level || ' уровня от нового пользователя'
+            FROM earnings
+        ),
+        done AS (
+            UPDATE referral_outbox
+            SET processed_at = CURRENT_TIMESTAMP
+            WHERE id IN (SELECT id FROM events)
+            RETURNING id
+        )
+        SELECT COUNT(*) FROM done
+    """, {
+        'batch_size': batch_size,
+        'bonus': REGISTRATION_BONUS,
+        'max_level': max(REFERRAL_LEVELS),
+        'levels': list(REFERRAL_LEVELS.keys()),
+        'rates': list(REFERRAL_LEVELS.values()),
+    })
+    processed = cursor.fetchone()[0]
+    cursor.close()
+    conn.commit()
+    return processed
+
+
+def fold_balances(conn) -> int:
+    """Свернуть накопленные balance_deltas в users; возвращает число обновлённых пользователей"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT fold_balance_deltas()")
+    folded = cursor.fetchone()[0]
+    cursor.close()
+    conn.commit()
+    return folded
+
+
+def rebuild_referral_stats(conn) -> int:
+    """Пересобрать referral_stats по referral_earnings; возвращает число строк сводки"""
+    cursor = conn.cursor()
+    cursor.execute("LOCK TABLE referral_stats IN EXCLUSIVE MODE")
+    cursor.execute("DELETE FROM referral_stats")
+    cursor.execute("""
+        INSERT INTO referral_stats (user_id, level, count, earned)
+        SELECT user_id, level, COUNT(DISTINCT referred_user_id), SUM(amount)
+        FROM referral_earnings
+        GROUP BY user_id, level
+    """)
+    rebuilt = cursor.rowcount
+    cursor.close()
+    conn.commit()
+    return rebuilt
+
+
+def drain(conn, batch_size: int = DEFAULT_BATCH_SIZE, max_batches: int = DEFAULT_MAX_BATCHES) -> int:
+    """Обрабатывать пакеты, пока очередь не опустеет или не кончится лимит пакетов,
+    затем свернуть накопленные изменения балансов"""
+    total = 0
+    for _ in range(max_batches):
+        processed = process_batch(conn, batch_size)
+        total += processed
+        if processed < batch_size:
+            break
+    fold_balances(conn)
+    return total
+
+
+def is_authorized(event: Dict[str, Any]) -> bool:
+    """Таймер вызывает функцию без httpMethod; HTTP-вызов пропускается только с верным
+    X-Payouts-Secret, без заданного PAYOUTS_SECRET - никогда"""
+    if 'httpMethod' not in event:
+        return True
+    headers = event.get('headers') or {}
+    secret = headers.get('X-Payouts-Secret') or headers.get('x-payouts-secret') or ''
+    return bool(PAYOUTS_SECRET) and hmac.compare_digest(secret.encode(), PAYOUTS_SECRET.encode())
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if not is_authorized(event):
+        return error(403, 'Доступ запрещён')
+
+    try:
+        body = loads(event.get('body') or '{}')
+        batch_size = min(max(int(body.get('batch_size', DEFAULT_BATCH_SIZE)), 1), MAX_BATCH_SIZE)
+        max_batches = min(max(int(body.get('max_batches', DEFAULT_MAX_BATCHES)), 1), MAX_MAX_BATCHES)
+    except (TypeError, ValueError):
+        return error(400, 'Некорректные параметры')
+
+    try:
+        with connection() as conn:
+            processed = drain(conn, batch_size, max_batches)
+    except Exception as e:
+        return error(500, str(e))
+
+    return respond(200, {'success': True, 'processed': processed})
+
+
+def main():
+    """Локальный запуск: python index.py [--loop] с DATABASE_URL в окружении"""
+    parser = argparse.ArgumentParser(description='Обработка очереди реферальных начислений')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--max-batches', type=int, default=DEFAULT_MAX_BATCHES)
+    parser.add_argument('--loop', action='store_true', help='не завершаться, опрашивать очередь')
+    parser.add_argument('--interval', type=float, default=2.0, help='пауза между опросами, секунды')
+    parser.add_argument('--rebuild-stats', action='store_true', help='пересобрать referral_stats и выйти')
+    args = parser.parse_args()
+
+    if args.rebuild_stats:
+        with connection() as conn:
+            print(json.dumps({'referral_stats_rows': rebuild_referral_stats(conn)}))
+        return
+
+    while True:
+        with connection() as conn:
+            processed = drain(conn, args.batch_size, args.max_batches)
+        print(json.dumps({'processed': processed}))
+        if not args.loop:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
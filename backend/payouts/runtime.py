@@ -0,0 +1,259 @@
+"""
+Business: Общая обвязка обработчиков функций: маршрутизация по методу и action, сборка ответов, JSON
+Args: event облачной функции; маршруты регистрируются декоратором Router.route(method, *actions)
+Returns: dict ответа облачной функции; JSON кодируется orjson (Decimal - числом, datetime - ISO 8601),
+         без orjson - стандартным json.dumps с теми же типами и его настройками по умолчанию.
+         При HANDLER_INSTRUMENTATION=1 каждый вызов замеряется: запросы к базе, строки, получение
+         соединения и общее время попадают в заголовок Server-Timing и в одну JSON-строку лога;
+         без переменной замеров нет вовсе. При HANDLER_PROFILE_RATE > 0 такая доля вызовов
+         выполняется под cProfile, профили пишутся в HANDLER_PROFILE_DIR
+         (свод - benchmarks/profiles.py)
+"""
+
+import cProfile
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from db import get_connection, release_connection
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+INSTRUMENTATION = os.environ.get('HANDLER_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+LOGGED_SQL_LENGTH = 120
+PROFILE_RATE = float(os.environ.get('HANDLER_PROFILE_RATE') or 0)
+PROFILE_DIR = os.environ.get('HANDLER_PROFILE_DIR', '/tmp/handler-profiles')
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Type is not JSON serializable: {type(value).__name__}')
+
+
+if orjson is not None:
+    def dumps(value: Any) -> str:
+        return orjson.dumps(value, default=_default).decode()
+
+    loads = orjson.loads
+else:
+    def dumps(value: Any) -> str:
+        return json.dumps(value, default=_default)
+
+    loads = json.loads
+
+
+def respond(status_code: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Ответ функции; строка передаётся в body как есть, остальное кодируется в JSON.
+    headers дополняют (или переопределяют) JSON_HEADERS."""
+    return {
+        'statusCode': status_code,
+        'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS,
+        'body': payload if isinstance(payload, str) else dumps(payload),
+        'isBase64Encoded': False
+    }
+
+
+def error(status_code: int, message: str) -> Dict[str, Any]:
+    return respond(status_code, {'error': message})
+
+
+class Timings:
+    """Замеры одного вызова: получение соединения и (мс, строк, текст) каждого запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.acquire_ms = 0.0
+        self.statements: List[Tuple[float, int, str]] = []
+
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor, записывающий время и число строк каждого execute в timings"""
+
+    timings: Optional[Timings] = None
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.timings.statements.append(((time.perf_counter() - started) * 1000, self.rowcount, query))
+
+
+class Request:
+    """Разобранный event; соединение из пула берётся при первом обращении к cursor"""
+
+    def __init__(self, event: Dict[str, Any], timings: Optional[Timings] = None):
+        self.event = event
+        self.timings = timings
+        self.method = event.get('httpMethod', 'GET')
+        self.headers = event.get('headers') or {}
+        self.params = event.get('queryStringParameters') or {}
+        self.conn = None
+        self.broken = False
+        self._cursor = None
+        self._body = None
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        if self._body is None:
+            self._body = loads(self.event.get('body') or '{}')
+        return self._body
+
+    @property
+    def action(self) -> Optional[str]:
+        """action из query-параметров для GET и из тела для остальных методов"""
+        return self.params.get('action') if self.method == 'GET' else self.body.get('action')
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            if self.timings is None:
+                self.conn = get_connection()
+                self._cursor = self.conn.cursor(cursor_factory=RealDictCursor)
+            else:
+                started = time.perf_counter()
+                self.conn = get_connection()
+                self.timings.acquire_ms += (time.perf_counter() - started) * 1000
+                self._cursor = self.conn.cursor(cursor_factory=TimedCursor)
+                self._cursor.timings = self.timings
+        return self._cursor
+
+    def close(self):
+        """Вернуть соединение в пул; незавершённую транзакцию откатывает пул, оборванное
+        соединение (broken) закрывается"""
+        if self._cursor is not None and not self._cursor.closed:
+            try:
+                self._cursor.close()
+            except psycopg2.Error:
+                self.broken = True
+        if self.conn is not None:
+            release_connection(self.conn, broken=self.broken)
+
+
+class Router:
+    """Таблица маршрутов (метод, action) -> функция(request). Маршрут без action обслуживает
+    метод по умолчанию; ответ на OPTIONS собирается один раз при регистрации маршрутов."""
+
+    def __init__(self, allow_headers: str, name: str = ''):
+        self.allow_headers = allow_headers
+        self.name = name
+        self.routes: Dict[str, Dict[Optional[str], Callable[[Request], Dict[str, Any]]]] = {}
+        self.preflight = self._build_preflight()
+
+    def route(self, method: str, *actions: str):
+        def register(fn: Callable[[Request], Dict[str, Any]]):
+            for action in actions or (None,):
+                self.routes.setdefault(method, {})[action] = fn
+            self.preflight = self._build_preflight()
+            return fn
+        return register
+
+    def _build_preflight(self) -> Dict[str, Any]:
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': ', '.join([*self.routes, 'OPTIONS']),
+                'Access-Control-Allow-Headers': self.allow_headers,
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    def __call__(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if PROFILE_RATE and random.random() < PROFILE_RATE:
+            return self._profile(event)
+        return self._call(event)
+
+    def _call(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        if not INSTRUMENTATION:
+            return self._dispatch(Request(event))
+        request = Request(event, Timings())
+        response = self._dispatch(request)
+        return self._report(request, response)
+
+    def _profile(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Вызов под cProfile; профиль сохраняется в PROFILE_DIR как <функция>-<метод>-<время>-<id>.pstats"""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # в интерпретаторе уже работает другой профилировщик - этот вызов не профилируем
+            return self._call(event)
+        try:
+            return self._call(event)
+        finally:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            method = event.get('httpMethod', 'GET')
+            filename = f'{self.name or "handler"}-{method}-{time.time_ns()}-{uuid.uuid4().hex[:8]}.pstats'
+            profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+
+    def _dispatch(self, request: Request) -> Dict[str, Any]:
+        if request.method == 'OPTIONS':
+            return self.preflight
+        routes = self.routes.get(request.method)
+        if routes is None:
+            return error(405, 'Method not allowed')
+
+        try:
+            fn = routes.get(request.action) or routes.get(None)
+            if fn is None:
+                return error(400, 'Неизвестное действие')
+            return fn(request)
+        # Незавершённую транзакцию откатывает пул в request.close(); соединение, оборвавшееся
+        # посреди запроса, помечается broken и закрывается вместо возврата в пул
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            request.broken = True
+            return error(500, str(e))
+        except Exception as e:
+            return error(500, str(e))
+        finally:
+            request.close()
+
+    def _report(self, request: Request, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Добавить Server-Timing к ответу и вывести строку лога с замерами вызова"""
+        timings = request.timings
+        total_ms = (time.perf_counter() - timings.started) * 1000
+        db_ms = sum(ms for ms, _, _ in timings.statements)
+        try:
+            action = request.action
+        except Exception:
+            action = None
+        print(dumps({
+            'function': self.name,
+            'method': request.method,
+            'action': action,
+            'status': response['statusCode'],
+            'total_ms': round(total_ms, 3),
+            'acquire_ms': round(timings.acquire_ms, 3),
+            'db_ms': round(db_ms, 3),
+            'statements': len(timings.statements),
+            'rows': sum(max(rows, 0) for _, rows, _ in timings.statements),
+            'queries': [
+                {'ms': round(ms, 3), 'rows': rows, 'sql': ' '.join(query.split())[:LOGGED_SQL_LENGTH]}
+                for ms, rows, query in timings.statements
+            ],
+        }), file=sys.stdout, flush=True)
+
+        server_timing = (f'db;dur={db_ms:.2f};desc="{len(timings.statements)} queries", '
+                         f'acquire;dur={timings.acquire_ms:.2f}, total;dur={total_ms:.2f}')
+        return {
+            **response,
+            'headers': {**response['headers'], 'Server-Timing': server_timing, 'Timing-Allow-Origin': '*'}
+        }
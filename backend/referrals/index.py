@@ -1,149 +1,268 @@
 """
 Business: Получение реферальной статистики пользователя (5 уровней)
-Args: event - dict с httpMethod, headers (X-User-Id)
-Returns: HTTP response со статистикой рефералов по уровням
+Args: event - dict с httpMethod, headers (X-Auth-Token, If-None-Match), queryStringParameters
+      (before=<created_at,id>, limit; action=downline с max_depth, limit; action=bundle)
+Returns: HTTP response со статистикой рефералов по уровням, деревом приглашённых или
+         сводкой для личного кабинета (статистика, заявки на вывод, последние транзакции);
+         ETag по версии данных пользователя, 304 если версия не изменилась. Дерево (downline)
+         отдаётся без ETag: регистрации приглашённых версию не меняют
 """
 
-import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, Optional, Tuple
+from datetime import datetime
+from runtime import Request, Router, dumps, error, loads, respond
+import sessions
+from versioning import etag_headers, fetch_data_version, make_etag, is_not_modified, not_modified_response
 
-DATABASE_URL = os.environ.get('DATABASE_URL')
 
+LEVEL_PERCENTAGES = {
+    1: 10,
+    2: 5,
+    3: 3,
+    4: 2,
+    5: 1
+}
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method = event.get('httpMethod', 'GET')
+
+RECENT_DEFAULT_LIMIT = 50
+RECENT_MAX_LIMIT = 200
+DOWNLINE_DEFAULT_LIMIT = 500
+DOWNLINE_MAX_LIMIT = 5000
+BUNDLE_WITHDRAWALS_LIMIT = 50
+BUNDLE_TRANSACTIONS_LIMIT = 20
+
+
+def parse_page(params: Dict[str, Any]) -> Tuple[Optional[datetime], Optional[int], int]:
+    """Курсор before=<created_at,id> и limit из query-параметров; ValueError при неверном формате"""
+    limit = int(params.get('limit') or RECENT_DEFAULT_LIMIT)
+    if limit < 1:
+        raise ValueError('limit')
+    limit = min(limit, RECENT_MAX_LIMIT)
+    before = params.get('before')
+    if not before:
+        return None, None, limit
+    created_at, _, earning_id = before.rpartition(',')
+    return datetime.fromisoformat(created_at), int(earning_id), limit
+
+
+def fetch_stats_payload(cursor, user_id, before_created_at: Optional[datetime] = None,
+                        before_id: Optional[int] = None, limit: int = RECENT_DEFAULT_LIMIT) -> Optional[str]:
+    """Весь ответ (профиль, уровни, итоги, страница последних рефералов) одним запросом в виде готового JSON.
+    Итоги считаются по строкам уровней, а не отдельным проходом. Страница выбирается по ключу
+    (created_at, id) из индекса idx_referral_earnings_user_created, поэтому глубокие страницы
+    стоят столько же, сколько первая. None - пользователь не найден."""
+    cursor.execute("""
+        WITH profile AS (
+            SELECT u.id, u.email, u.username, u.referral_code, b.balance, b.total_earned
+            FROM users u
+            JOIN user_balances b ON b.user_id = u.id
+            WHERE u.id = %(user_id)s
+        ),
+        stats AS (
+            SELECT lv.level, COALESCE(rs.count, 0) AS count, COALESCE(rs.earned, 0) AS earned, lv.percentage
+            FROM unnest(%(levels)s::int[], %(percentages)s::int[]) AS lv(level, percentage)
+            LEFT JOIN referral_stats rs ON rs.user_id = %(user_id)s AND rs.level = lv.level
+        ),
+        page AS (
+            SELECT re.id, re.referred_user_id, re.level, re.amount, re.created_at
+            FROM referral_earnings re
+            WHERE re.user_id = %(user_id)s
+              AND (%(before_created_at)s::timestamp IS NULL
+                   OR (re.created_at, re.id) < (%(before_created_at)s::timestamp, %(before_id)s))
+            ORDER BY re.created_at DESC, re.id DESC
+            LIMIT %(limit)s
+        ),
+        recent AS (
+            SELECT u.id, u.username, u.email, page.level, page.amount, page.created_at, page.id AS earning_id
+            FROM page
+            JOIN users u ON page.referred_user_id = u.id
+        )
+        SELECT json_build_object(
+            'user', row_to_json(profile),
+            'total_referrals', (SELECT SUM(count) FROM stats),
+            'total_referral_earnings', (SELECT SUM(earned) FROM stats),
+            'levels', (
+                SELECT json_object_agg(
+                    'level_' || level,
+                    json_build_object('count', count, 'earned', earned, 'percentage', percentage)
+                    ORDER BY level
+                )
+                FROM stats
+            ),
+            'recent_referrals', (
+                SELECT COALESCE(json_agg(recent ORDER BY created_at DESC, earning_id DESC), '[]'::json) FROM recent
+            ),
+            'next_before', (
+                SELECT created_at || ',' || id
+                FROM page
+                WHERE (SELECT COUNT(*) FROM page) = %(limit)s
+                ORDER BY created_at, id
+                LIMIT 1
+            )
+        )::text AS payload
+        FROM profile
+    """, {
+        'user_id': user_id,
+        'levels': list(LEVEL_PERCENTAGES.keys()),
+        'percentages': list(LEVEL_PERCENTAGES.values()),
+        'before_created_at': before_created_at,
+        'before_id': before_id,
+        'limit': limit,
+    })
+    row = cursor.fetchone()
+    return row['payload'] if row else None
+
+
+def fetch_downline_payload(cursor, user_id, max_depth: int, limit: int) -> str:
+    """Число приглашённых по глубинам и узлы дерева (до limit, по глубине) из referral_closure.
+    Родитель узла - parent_id, клиент собирает дерево сам."""
+    cursor.execute("""
+        WITH counts AS (
+            SELECT depth, COUNT(*) AS count
+            FROM referral_closure
+            WHERE ancestor_id = %(user_id)s AND depth BETWEEN 1 AND %(max_depth)s
+            GROUP BY depth
+        ),
+        nodes AS (
+            SELECT u.id, u.username, u.referred_by_id AS parent_id, rc.depth, u.created_at
+            FROM referral_closure rc
+            JOIN users u ON u.id = rc.descendant_id
+            WHERE rc.ancestor_id = %(user_id)s AND rc.depth BETWEEN 1 AND %(max_depth)s
+            ORDER BY rc.depth, rc.descendant_id
+            LIMIT %(limit)s
+        )
+        SELECT json_build_object(
+            'counts', (
+                SELECT COALESCE(json_object_agg('depth_' || depth, count ORDER BY depth), '{}'::json)
+                FROM counts
+            ),
+            'total', (SELECT COALESCE(SUM(count), 0) FROM counts),
+            'nodes', (SELECT COALESCE(json_agg(nodes ORDER BY depth, id), '[]'::json) FROM nodes),
+            'truncated', (SELECT COALESCE(SUM(count), 0) FROM counts) > (SELECT COUNT(*) FROM nodes)
+        )::text AS payload
+    """, {
+        'user_id': user_id,
+        'max_depth': max_depth,
+        'limit': limit,
+    })
+    return cursor.fetchone()['payload']
+
+
+def fetch_bundle_payload(cursor, user_id) -> Optional[str]:
+    """Сводка для личного кабинета в одном снимке базы: ответ статистики плюс заявки на вывод
+    и последние транзакции пользователя. Вызывается в транзакции REPEATABLE READ READ ONLY,
+    чтобы все части ответа пришли из одного снимка. Записать balance_after в ней нельзя, поэтому
+    недосчитанный хвост журнала считается в запросе так же, как fill_transaction_balances.
+    None - пользователь не найден."""
+    stats = fetch_stats_payload(cursor, user_id)
+    if stats is None:
+        return None
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    cursor.execute("""
+        WITH first_missing AS (
+            SELECT created_at, id
+            FROM transactions
+            WHERE user_id = %(user_id)s AND balance_after IS NULL
+            ORDER BY created_at, id
+            LIMIT 1
+        ),
+        base AS (
+            SELECT t.balance_after
+            FROM transactions t, first_missing f
+            WHERE t.user_id = %(user_id)s AND (t.created_at, t.id) < (f.created_at, f.id)
+            ORDER BY t.created_at DESC, t.id DESC
+            LIMIT 1
+        ),
+        tail AS (
+            SELECT t.id,
+                   COALESCE((SELECT balance_after FROM base), 0)
+                   + SUM(t.amount) OVER (ORDER BY t.created_at, t.id) AS running
+            FROM transactions t, first_missing f
+            WHERE t.user_id = %(user_id)s AND (t.created_at, t.id) >= (f.created_at, f.id)
+        ),
+        recent AS (
+            SELECT t.id, t.type, t.amount, t.description,
+                   COALESCE(tail.running, t.balance_after) AS balance_after, t.created_at
+            FROM transactions t
+            LEFT JOIN tail ON tail.id = t.id
+            WHERE t.user_id = %(user_id)s
+            ORDER BY t.created_at DESC, t.id DESC
+            LIMIT %(transactions_limit)s
+        )
+        SELECT json_build_object(
+            'withdrawal_requests', (
+                SELECT COALESCE(json_agg(w ORDER BY w.created_at DESC, w.id DESC), '[]'::json)
+                FROM (
+                    SELECT id, amount, payment_method, payment_details, status, admin_comment,
+                           created_at, processed_at
+                    FROM withdrawal_requests
+                    WHERE user_id = %(user_id)s
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %(withdrawals_limit)s
+                ) w
+            ),
+            'recent_transactions', (
+                SELECT COALESCE(json_agg(t ORDER BY t.created_at DESC, t.id DESC), '[]'::json)
+                FROM recent t
+            )
+        ) AS payload
+    """, {
+        'user_id': user_id,
+        'withdrawals_limit': BUNDLE_WITHDRAWALS_LIMIT,
+        'transactions_limit': BUNDLE_TRANSACTIONS_LIMIT,
+    })
+    bundle = loads(stats)
+    bundle.update(cursor.fetchone()['payload'])
+    return dumps(bundle)
+
+
+router = Router('Content-Type, X-Auth-Token, Authorization, If-None-Match', name='referrals')
+
+
+@router.route('GET')
+def get_referrals(request: Request) -> Dict[str, Any]:
+    session, denied = sessions.require(request)
+    if denied:
+        return denied
     
-    if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+    user_id = session['user_id']
+    params = request.params
+    action = params.get('action')
     
     try:
-        headers = event.get('headers', {})
-        user_id = headers.get('X-User-Id') or headers.get('x-user-id')
-        
-        if not user_id:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Требуется авторизация'}),
-                'isBase64Encoded': False
-            }
-        
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute("""
-            SELECT id, email, username, referral_code, balance, total_earned
-            FROM users WHERE id = %s
-        """, (user_id,))
-        
-        user = cursor.fetchone()
-        
-        if not user:
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Пользователь не найден'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute("""
-            SELECT 
-                level,
-                COUNT(DISTINCT referred_user_id) as count,
-                SUM(amount) as total_earned
-            FROM referral_earnings
-            WHERE user_id = %s
-            GROUP BY level
-            ORDER BY level
-        """, (user_id,))
-        
-        levels_data = cursor.fetchall()
-        
-        cursor.execute("""
-            SELECT COUNT(DISTINCT referred_user_id) as total_referrals,
-                   SUM(amount) as total_referral_earnings
-            FROM referral_earnings
-            WHERE user_id = %s
-        """, (user_id,))
-        
-        totals = cursor.fetchone()
-        
-        cursor.execute("""
-            SELECT 
-                u.id,
-                u.username,
-                u.email,
-                re.level,
-                re.amount,
-                re.created_at
-            FROM referral_earnings re
-            JOIN users u ON re.referred_user_id = u.id
-            WHERE re.user_id = %s
-            ORDER BY re.created_at DESC
-            LIMIT 50
-        """, (user_id,))
-        
-        recent_referrals = cursor.fetchall()
-        
-        levels = {}
-        for i in range(1, 6):
-            levels[f'level_{i}'] = {
-                'count': 0,
-                'earned': 0.0,
-                'percentage': [10, 5, 3, 2, 1][i-1]
-            }
-        
-        for level_data in levels_data:
-            level_num = level_data['level']
-            levels[f'level_{level_num}'] = {
-                'count': level_data['count'],
-                'earned': float(level_data['total_earned'] or 0),
-                'percentage': [10, 5, 3, 2, 1][level_num-1]
-            }
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'user': dict(user),
-                'total_referrals': totals['total_referrals'] or 0,
-                'total_referral_earnings': float(totals['total_referral_earnings'] or 0),
-                'levels': levels,
-                'recent_referrals': [dict(r) for r in recent_referrals]
-            }, default=str),
-            'isBase64Encoded': False
-        }
+        if action == 'downline':
+            max_depth = min(max(int(params.get('max_depth') or len(LEVEL_PERCENTAGES)), 1), len(LEVEL_PERCENTAGES))
+            limit = min(max(int(params.get('limit') or DOWNLINE_DEFAULT_LIMIT), 0), DOWNLINE_MAX_LIMIT)
+        elif action != 'bundle':
+            before_created_at, before_id, limit = parse_page(params)
+    except ValueError:
+        return error(400, 'Некорректные параметры')
+    
+    cursor = request.cursor
+    if action == 'downline':
+        return respond(200, fetch_downline_payload(cursor, user_id, max_depth, limit))
+    
+    if action == 'bundle':
+        # Проверка сессии могла открыть транзакцию, а снимок должен начаться с SET TRANSACTION
+        request.conn.rollback()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    
+    version = fetch_data_version(cursor, user_id)
     
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+    if version is None:
+        return error(404, 'Пользователь не найден')
+    
+    etag = make_etag(user_id, version)
+    if is_not_modified(request.headers, etag):
+        return not_modified_response(etag)
+    
+    if action == 'bundle':
+        payload = fetch_bundle_payload(cursor, user_id)
+    else:
+        payload = fetch_stats_payload(cursor, user_id, before_created_at, before_id, limit)
+    
+    return respond(200, payload, etag_headers(etag))
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return router(event, context)
@@ -0,0 +1,19 @@
+-- Данные, на которые рассчитаны backend/*/tests.json; применять к тестовой базе после db_migrations/.
+-- Пользователь 1 с балансом и сессией для токена test-session-token: тесты referrals и withdrawals
+-- передают его в X-Auth-Token, в sessions хранится только SHA-256 токена.
+-- Email отличается от test@example.com, который регистрирует auth/tests.json
+INSERT INTO users (id, email, password_hash, username, referral_code, balance)
+VALUES (1, 'fixture@example.com', encode(sha256(convert_to('fixture-password', 'UTF8')), 'hex'), 'Fixture',
+        referral_code_from_id(1), 1000)
+ON CONFLICT (id) DO UPDATE SET balance = GREATEST(users.balance, 1000);
+
+INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+VALUES (1, 1, 0)
+ON CONFLICT DO NOTHING;
+
+INSERT INTO sessions (token_hash, user_id, is_admin, expires_at)
+VALUES (encode(sha256(convert_to('test-session-token', 'UTF8')), 'hex'), 1, FALSE,
+        CURRENT_TIMESTAMP + INTERVAL '10 years')
+ON CONFLICT (token_hash) DO UPDATE SET expires_at = EXCLUDED.expires_at;
+
+SELECT setval(pg_get_serial_sequence('users', 'id'), GREATEST((SELECT MAX(id) FROM users), 1));
@@ -0,0 +1,160 @@
+"""
+Business: Пул соединений с PostgreSQL, переживающий тёплые вызовы функции
+Args: настройки из переменных окружения DATABASE_URL, DB_POOL_*
+Returns: get_connection / release_connection и контекстный менеджер connection
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Tuple
+import psycopg2
+from psycopg2 import extensions
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '5'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+
+class PoolTimeout(RuntimeError):
+    """Все соединения пула заняты дольше допустимого"""
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений с проверкой перед выдачей и вытеснением простаивающих"""
+
+    def __init__(self, dsn: str, max_size: int, idle_timeout: float,
+                 check_after: float, acquire_timeout: float):
+        self.dsn = dsn
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.acquire_timeout = acquire_timeout
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Выдать живое соединение: из простаивающих или новое, если есть место"""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._cond:
+                self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout('Нет свободных соединений с базой данных')
+                    self._cond.wait(remaining)
+                    continue
+
+            if conn is None:
+                try:
+                    return psycopg2.connect(self.dsn)
+                except Exception:
+                    self._forget()
+                    raise
+
+            if time.monotonic() - last_used < self.check_after or self._is_alive(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, broken: bool = False):
+        """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+        if broken or conn.closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        fresh = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.idle_timeout:
+                self._size -= 1
+                _close_quietly(conn)
+            else:
+                fresh.append((conn, last_used))
+        self._idle = fresh
+
+    def _is_alive(self, conn) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        _close_quietly(conn)
+        self._forget()
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Пул уровня модуля: создаётся при первом вызове и живёт, пока жив контейнер"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE_URL, POOL_MAX_SIZE, POOL_IDLE_TIMEOUT,
+                                       POOL_CHECK_AFTER, POOL_ACQUIRE_TIMEOUT)
+    return _pool
+
+
+def get_connection():
+    """Взять соединение из пула"""
+    return get_pool().acquire()
+
+
+def release_connection(conn, broken: bool = False):
+    """Вернуть соединение в пул"""
+    get_pool().release(conn, broken=broken)
+
+
+@contextmanager
+def connection() -> Iterator:
+    """Соединение из пула на время блока with; при сетевой ошибке оно выбрасывается"""
+    conn = get_connection()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        release_connection(conn, broken=broken)
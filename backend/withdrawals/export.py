@@ -0,0 +1,110 @@
+"""
+Business: Выгрузка заявок на вывод и журнала транзакций в CSV или NDJSON
+Args: соединение, набор данных (withdrawals / transactions), формат и фильтры
+Returns: генератор пар (id, строка выгрузки); строки читаются серверным курсором пачками фиксированного размера
+"""
+
+import csv
+import io
+import uuid
+from typing import Any, Dict, Iterator, Optional, Tuple
+from psycopg2.extras import RealDictCursor
+from runtime import dumps
+
+EXPORT_BATCH_SIZE = 2000
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+DATASETS = {
+    'withdrawals': {
+        'columns': ['id', 'user_id', 'username', 'email', 'amount', 'payment_method', 'payment_details',
+                    'status', 'admin_comment', 'created_at', 'processed_at', 'processed_by'],
+        'query': """
+            SELECT wr.id, wr.user_id, u.username, u.email, wr.amount, wr.payment_method, wr.payment_details,
+                   wr.status, wr.admin_comment, wr.created_at, wr.processed_at, wr.processed_by
+            FROM withdrawal_requests wr
+            JOIN users u ON wr.user_id = u.id
+        """,
+        'alias': 'wr',
+        'status_column': 'status',
+    },
+    'transactions': {
+        'columns': ['id', 'user_id', 'type', 'amount', 'description', 'created_at'],
+        'query': """
+            SELECT t.id, t.user_id, t.type, t.amount, t.description, t.created_at
+            FROM transactions t
+        """,
+        'alias': 't',
+        'status_column': 'type',
+    },
+}
+
+
+def iter_export(conn, dataset: str, fmt: str, filters: Dict[str, Any],
+                after_id: int = 0, limit: Optional[int] = None) -> Iterator[Tuple[Optional[int], str]]:
+    """Пары (id, строка) в порядке id, начиная после after_id; для CSV первой идёт заголовок с id None.
+    filters: status (для транзакций - тип), date_from, date_to. Память не зависит от размера таблицы."""
+    spec = DATASETS[dataset]
+    alias = spec['alias']
+    conditions = [f"{alias}.id > %(after_id)s"]
+    if filters.get('status'):
+        conditions.append(f"{alias}.{spec['status_column']} = %(status)s")
+    if filters.get('date_from'):
+        conditions.append(f"{alias}.created_at >= %(date_from)s")
+    if filters.get('date_to'):
+        conditions.append(f"{alias}.created_at < %(date_to)s")
+    limit_clause = 'LIMIT %(limit)s' if limit else ''
+
+    cursor = conn.cursor(name=f'export_{uuid.uuid4().hex}', cursor_factory=RealDictCursor)
+    cursor.itersize = EXPORT_BATCH_SIZE
+    try:
+        cursor.execute(f"""
+            {spec['query']}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {alias}.id
+            {limit_clause}
+        """, {**filters, 'after_id': after_id, 'limit': limit})
+
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            yield None, _csv_line(writer, buffer, spec['columns'])
+            for row in cursor:
+                yield row['id'], _csv_line(writer, buffer, [row[c] for c in spec['columns']])
+        else:
+            for row in cursor:
+                yield row['id'], dumps(row) + '\n'
+    finally:
+        cursor.close()
+
+
+def _csv_line(writer, buffer: io.StringIO, values) -> str:
+    writer.writerow(values)
+    line = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return line
+
+
+def main():
+    """Локальная выгрузка в stdout: python export.py transactions --format csv --date-from 2024-01-01"""
+    import argparse
+    import sys
+    from datetime import datetime
+    from db import connection
+
+    parser = argparse.ArgumentParser(description='Выгрузка заявок на вывод или транзакций')
+    parser.add_argument('dataset', choices=sorted(DATASETS))
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--status', help='статус заявки или тип транзакции')
+    parser.add_argument('--date-from', type=datetime.fromisoformat)
+    parser.add_argument('--date-to', type=datetime.fromisoformat)
+    args = parser.parse_args()
+
+    filters = {'status': args.status, 'date_from': args.date_from, 'date_to': args.date_to}
+    with connection() as conn:
+        for _, line in iter_export(conn, args.dataset, args.format, filters):
+            sys.stdout.write(line)
+
+
+if __name__ == '__main__':
+    main()
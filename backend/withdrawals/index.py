@@ -1,271 +1,579 @@
 """
 Business: Управление заявками на вывод средств (создание, просмотр, обработка админом)
-Args: event - dict с httpMethod, body, headers (X-User-Id для пользователя)
-Returns: HTTP response со списком заявок или результатом операции
+Args: event - dict с httpMethod, body, headers (X-Auth-Token - токен сессии, Idempotency-Key для POST,
+      If-None-Match для своего списка заявок и истории),
+      queryStringParameters для админа (status, date_from, date_to, user_id, amount_min, amount_max, before, limit;
+      action=export с dataset, format, after_id; action=history с type, before, limit)
+Returns: HTTP response со списком заявок или результатом операции; история транзакций содержит
+         balance_after - баланс по журналу без удержаний по открытым заявкам - и текущий held_balance
 """
 
-import json
-import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from export import DATASETS, EXPORT_FORMATS, iter_export
+from runtime import Request, Router, error, respond
+import idempotency
+import sessions
+from versioning import current_etag, etag_headers, is_not_modified, not_modified_response
 
-DATABASE_URL = os.environ.get('DATABASE_URL')
+WITHDRAWAL_STATUSES = ('pending', 'approved', 'rejected', 'completed')
+ADMIN_PAGE_DEFAULT_LIMIT = 100
+ADMIN_PAGE_MAX_LIMIT = 500
+TRANSACTION_TYPES = ('referral', 'withdrawal', 'bonus')
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+PROCESS_STATUSES = ('approved', 'rejected', 'completed')
+BATCH_MAX_ITEMS = 1000
+REQUEST_ID_MAX = 2147483647
+CLAIM_STATUSES = ('pending', 'approved')
+CLAIM_DEFAULT_LIMIT = 20
+CLAIM_MAX_LIMIT = 200
+CLAIM_DEFAULT_LEASE = 300
+CLAIM_MAX_LEASE = 3600
+# Страница выгрузки собирается в одно тело ответа, поэтому ограничена несколькими тысячами
+# строк (лимит размера ответа функции); следующие страницы - по X-Export-Next-After-Id
+EXPORT_DEFAULT_LIMIT = 2000
+EXPORT_MAX_LIMIT = 5000
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
 
+PROCESS_ERRORS = {
+    'invalid': (400, 'Некорректные данные'),
+    'not_found': (404, 'Заявка не найдена'),
+    'not_approved': (400, 'Заявка должна быть сначала одобрена'),
+    'insufficient_funds': (400, 'Недостаточно средств у пользователя'),
+    'claimed': (409, 'Заявка взята в работу другим администратором'),
+    'already_processed': (400, 'Заявка уже обработана'),
+}
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Admin-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+
+def parse_admin_filters(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Фильтры и курсор очереди заявок из query-параметров; ValueError при неверных значениях"""
+    status = params.get('status') or None
+    if status and status not in WITHDRAWAL_STATUSES:
+        raise ValueError('status')
+    filters = {
+        'status': status,
+        'date_from': datetime.fromisoformat(params['date_from']) if params.get('date_from') else None,
+        'date_to': datetime.fromisoformat(params['date_to']) if params.get('date_to') else None,
+        'user_id': int(params['user_id']) if params.get('user_id') else None,
+        'amount_min': float(params['amount_min']) if params.get('amount_min') else None,
+        'amount_max': float(params['amount_max']) if params.get('amount_max') else None,
+        'before_created_at': None,
+        'before_id': None,
+        'limit': min(max(int(params.get('limit') or ADMIN_PAGE_DEFAULT_LIMIT), 1), ADMIN_PAGE_MAX_LIMIT),
+    }
+    if params.get('before'):
+        filters['before_created_at'], filters['before_id'] = parse_before(params['before'])
+    return filters
+
+
+def parse_before(value: str) -> Tuple[datetime, int]:
+    """Курсор страницы вида <created_at,id>; ValueError при неверном формате"""
+    created_at, _, row_id = value.rpartition(',')
+    return datetime.fromisoformat(created_at), int(row_id)
+
+
+def fetch_admin_page(cursor, filters: Dict[str, Any]):
+    """Страница очереди заявок по ключу (created_at, id); возвращает строки и курсор следующей страницы"""
+    conditions = []
+    if filters['status']:
+        conditions.append("wr.status = %(status)s")
+    if filters['date_from']:
+        conditions.append("wr.created_at >= %(date_from)s")
+    if filters['date_to']:
+        conditions.append("wr.created_at < %(date_to)s")
+    if filters['user_id']:
+        conditions.append("wr.user_id = %(user_id)s")
+    if filters['amount_min'] is not None:
+        conditions.append("wr.amount >= %(amount_min)s")
+    if filters['amount_max'] is not None:
+        conditions.append("wr.amount <= %(amount_max)s")
+    if filters['before_created_at']:
+        conditions.append("(wr.created_at, wr.id) < (%(before_created_at)s, %(before_id)s)")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    cursor.execute(f"""
+        SELECT 
+            wr.*,
+            u.username,
+            u.email,
+            admin_user.username as processed_by_name
+        FROM withdrawal_requests wr
+        JOIN users u ON wr.user_id = u.id
+        LEFT JOIN users admin_user ON wr.processed_by = admin_user.id
+        {where}
+        ORDER BY wr.created_at DESC, wr.id DESC
+        LIMIT %(limit)s
+    """, filters)
     
+    rows = cursor.fetchall()
+    next_before = None
+    if len(rows) == filters['limit']:
+        next_before = f"{rows[-1]['created_at']},{rows[-1]['id']}"
+    return rows, next_before
+
+
+def fetch_history(cursor, user_id, tx_type, before_created_at, before_id, limit: int):
+    """Страница истории транзакций пользователя по ключу (created_at, id) с балансом после каждой
+    операции; недостающие balance_after досчитываются только для хвоста журнала.
+    balance_after - сумма журнала: удержание по заявке на вывод строки не пишет, поэтому пока
+    заявка открыта, он больше доступного баланса на held_balance пользователя."""
+    cursor.execute("SELECT fill_transaction_balances(%s)", (user_id,))
+    cursor.execute("""
+        SELECT id, type, amount, description, balance_after, created_at
+        FROM transactions
+        WHERE user_id = %(user_id)s
+          AND (%(type)s::text IS NULL OR type = %(type)s)
+          AND (%(before_created_at)s::timestamp IS NULL
+               OR (created_at, id) < (%(before_created_at)s::timestamp, %(before_id)s))
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    """, {
+        'user_id': user_id,
+        'type': tx_type,
+        'before_created_at': before_created_at,
+        'before_id': before_id,
+        'limit': limit,
+    })
+    rows = cursor.fetchall()
+    next_before = None
+    if len(rows) == limit:
+        next_before = f"{rows[-1]['created_at']},{rows[-1]['id']}"
+    return rows, next_before
+
+
+def process_requests(cursor, admin_id, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Смена статуса набора заявок одним запросом; результат по каждой заявке:
+    ok, invalid, not_found, claimed, not_approved, already_processed или insufficient_funds.
+    Заявки, арендованные другим исполнителем, не трогаются; аренда снимается при обработке.
+    Средства открытых заявок уже зарезервированы в held_balance: выплата списывает резерв,
+    отклонение возвращает его в balance. Изменения суммируются по пользователю, каждая строка
+    users обновляется один раз. Нехватка средств отменяет только выплаты пользователя, отклонения
+    проходят всегда. Ошибка одной заявки не отменяет остальные. Коммит - на вызывающей стороне."""
+    results = {}
+    valid = {}
+    for position, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        try:
+            request_id = int(item.get('request_id'))
+        except (TypeError, ValueError):
+            request_id = None
+        if request_id is not None and not 0 < request_id <= REQUEST_ID_MAX:
+            # id вне диапазона INTEGER сорвал бы приведение %(ids)s::int[] для всего пакета
+            request_id = None
+        status = item.get('status')
+        if request_id is None or status not in PROCESS_STATUSES or request_id in valid:
+            results[position] = {'request_id': item.get('request_id'), 'result': 'invalid'}
+            continue
+        valid[request_id] = (position, status, item.get('admin_comment', ''))
+    
+    if valid:
+        ids = list(valid.keys())
+        # Строки пользователей блокируются до проверки средств, по той же причине, что в create_request
+        cursor.execute("""
+            SELECT id FROM users
+            WHERE id IN (SELECT user_id FROM withdrawal_requests WHERE id = ANY(%s::int[]))
+            ORDER BY id
+            FOR UPDATE
+        """, (ids,))
+        cursor.execute("""
+            WITH items AS (
+                SELECT * FROM unnest(%(ids)s::int[], %(statuses)s::text[], %(comments)s::text[])
+                    AS i(request_id, new_status, admin_comment)
+            ),
+            locked AS (
+                SELECT wr.id, wr.user_id, wr.amount, wr.status AS old_status, items.new_status, items.admin_comment,
+                       wr.claimed_by IS NOT NULL AND wr.claimed_by <> %(admin_id)s
+                           AND wr.claimed_until > CURRENT_TIMESTAMP AS claimed_by_other
+                FROM withdrawal_requests wr
+                JOIN items ON items.request_id = wr.id
+                FOR UPDATE OF wr
+            ),
+            allowed AS (
+                SELECT * FROM locked
+                WHERE NOT claimed_by_other
+                  AND ((new_status = 'approved' AND old_status = 'pending')
+                       OR (new_status = 'rejected' AND old_status IN ('pending', 'approved'))
+                       OR (new_status = 'completed' AND old_status = 'approved'))
+            ),
+            funds AS (
+                SELECT user_id,
+                       COALESCE(SUM(amount) FILTER (WHERE new_status = 'completed'), 0) AS paid,
+                       COALESCE(SUM(amount) FILTER (WHERE new_status = 'rejected'), 0) AS released
+                FROM allowed
+                WHERE new_status IN ('completed', 'rejected')
+                GROUP BY user_id
+            ),
+            checked AS (
+                SELECT users.id,
+                       users.balance + users.held_balance
+                       + COALESCE((SELECT SUM(balance_delta) FROM balance_deltas WHERE user_id = users.id), 0)
+                       >= funds.paid AS sufficient
+                FROM users
+                JOIN funds ON funds.user_id = users.id
+            ),
+            moved AS (
+                UPDATE users
+                SET balance = users.balance + funds.released,
+                    held_balance = users.held_balance - funds.released
+                                   - CASE WHEN checked.sufficient THEN funds.paid ELSE 0 END
+                FROM funds
+                JOIN checked ON checked.id = funds.user_id
+                WHERE users.id = funds.user_id
+                RETURNING users.id, checked.sufficient
+            ),
+            done AS (
+                SELECT * FROM allowed
+                WHERE new_status IN ('approved', 'rejected')
+                   OR user_id IN (SELECT id FROM moved WHERE sufficient)
+            ),
+            ledger AS (
+                INSERT INTO transactions (user_id, type, amount, description)
+                SELECT user_id, 'withdrawal', -amount, 'Вывод средств #' || id
+                FROM done
+                WHERE new_status = 'completed'
+            ),
+            applied AS (
+                UPDATE withdrawal_requests wr
+                SET status = done.new_status, admin_comment = done.admin_comment,
+                    processed_at = %(now)s, processed_by = %(admin_id)s,
+                    claimed_by = NULL, claimed_until = NULL
+                FROM done
+                WHERE wr.id = done.id
+                RETURNING wr.id
+            )
+            SELECT
+                items.request_id,
+                CASE
+                    WHEN applied.id IS NOT NULL THEN 'ok'
+                    WHEN locked.id IS NULL THEN 'not_found'
+                    WHEN locked.claimed_by_other THEN 'claimed'
+                    WHEN locked.new_status = 'completed' AND locked.old_status <> 'approved' THEN 'not_approved'
+                    WHEN allowed.id IS NULL THEN 'already_processed'
+                    ELSE 'insufficient_funds'
+                END AS result
+            FROM items
+            LEFT JOIN locked ON locked.id = items.request_id
+            LEFT JOIN allowed ON allowed.id = items.request_id
+            LEFT JOIN applied ON applied.id = items.request_id
+        """, {
+            'ids': ids,
+            'statuses': [valid[i][1] for i in ids],
+            'comments': [valid[i][2] for i in ids],
+            'now': datetime.now(),
+            'admin_id': admin_id,
+        })
+        
+        for row in cursor.fetchall():
+            results[valid[row['request_id']][0]] = {'request_id': row['request_id'], 'result': row['result']}
+    
+    return [results[position] for position in range(len(items))]
+
+
+def claim_requests(cursor, admin_id, status: str, limit: int, lease_seconds: int) -> List[Dict[str, Any]]:
+    """Взять в работу до limit самых старых заявок со статусом status на lease_seconds секунд.
+    Заявки, заблокированные параллельным исполнителем, пропускаются (SKIP LOCKED), поэтому
+    несколько админов и обработчиков разбирают очередь без пересечений. Свои ещё не
+    истёкшие аренды продлеваются."""
+    cursor.execute("""
+        WITH candidates AS (
+            SELECT id
+            FROM withdrawal_requests
+            WHERE status = %(status)s
+              AND (claimed_until IS NULL OR claimed_until <= CURRENT_TIMESTAMP OR claimed_by = %(admin_id)s)
+            ORDER BY created_at, id
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE withdrawal_requests wr
+        SET claimed_by = %(admin_id)s,
+            claimed_until = CURRENT_TIMESTAMP + %(lease_seconds)s * INTERVAL '1 second'
+        FROM candidates
+        WHERE wr.id = candidates.id
+        RETURNING wr.*
+    """, {
+        'status': status,
+        'admin_id': admin_id,
+        'limit': limit,
+        'lease_seconds': lease_seconds,
+    })
+    return sorted(cursor.fetchall(), key=lambda r: (r['created_at'], r['id']))
+
+
+def release_requests(cursor, admin_id, request_ids: List[int]) -> int:
+    """Вернуть свои заявки в очередь до истечения аренды"""
+    cursor.execute("""
+        UPDATE withdrawal_requests
+        SET claimed_by = NULL, claimed_until = NULL
+        WHERE id = ANY(%s) AND claimed_by = %s
+    """, (request_ids, admin_id))
+    return cursor.rowcount
+
+
+router = Router('Content-Type, X-Auth-Token, Authorization, Idempotency-Key, If-None-Match', name='withdrawals')
+
+
+@router.route('GET', 'history')
+def get_history(request: Request) -> Dict[str, Any]:
+    session, denied = sessions.require(request)
+    if denied:
+        return denied
+    
+    params = request.params
+    try:
+        tx_type = params.get('type') or None
+        if tx_type and tx_type not in TRANSACTION_TYPES:
+            raise ValueError('type')
+        before_created_at, before_id = parse_before(params['before']) if params.get('before') else (None, None)
+        limit = min(max(int(params.get('limit') or HISTORY_DEFAULT_LIMIT), 1), HISTORY_MAX_LIMIT)
+    except ValueError:
+        return error(400, 'Некорректные параметры')
+    
+    user_id = session['user_id']
+    etag = current_etag(request.cursor, user_id)
+    if etag and is_not_modified(request.headers, etag):
+        return not_modified_response(etag)
+    
+    transactions, next_before = fetch_history(request.cursor, user_id, tx_type, before_created_at, before_id, limit)
+    request.cursor.execute("SELECT held_balance FROM users WHERE id = %s", (user_id,))
+    held_balance = request.cursor.fetchone()['held_balance']
+    request.conn.commit()
+    
+    return respond(200, {
+        'transactions': transactions,
+        'held_balance': held_balance,
+        'next_before': next_before
+    }, etag_headers(etag))
+
+
+@router.route('GET', 'export')
+def get_export(request: Request) -> Dict[str, Any]:
+    session, denied = sessions.require(request, admin=True)
+    if denied:
+        return denied
+    
+    params = request.params
     try:
-        headers = event.get('headers', {})
-        user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+        dataset = params.get('dataset', 'withdrawals')
+        fmt = params.get('format', 'csv')
+        if dataset not in DATASETS or fmt not in EXPORT_FORMATS:
+            raise ValueError('dataset')
+        export_filters = {
+            'status': params.get('status') or None,
+            'date_from': datetime.fromisoformat(params['date_from']) if params.get('date_from') else None,
+            'date_to': datetime.fromisoformat(params['date_to']) if params.get('date_to') else None,
+        }
+        after_id = int(params.get('after_id') or 0)
+        limit = min(max(int(params.get('limit') or EXPORT_DEFAULT_LIMIT), 1), EXPORT_MAX_LIMIT)
+    except ValueError:
+        return error(400, 'Некорректные параметры выгрузки')
+    
+    lines = []
+    last_id = None
+    for row_id, line in iter_export(request.conn, dataset, fmt, export_filters, after_id, limit):
+        lines.append(line)
+        last_id = row_id if row_id is not None else last_id
+    rows = len(lines) - (1 if fmt == 'csv' else 0)
+    
+    export_headers = {
+        'Content-Type': EXPORT_CONTENT_TYPES[fmt],
+        'Access-Control-Expose-Headers': 'X-Export-Next-After-Id'
+    }
+    if rows == limit:
+        export_headers['X-Export-Next-After-Id'] = str(last_id)
+    
+    return respond(200, ''.join(lines), export_headers)
+
+
+@router.route('GET')
+def get_requests(request: Request) -> Dict[str, Any]:
+    session, denied = sessions.require(request)
+    if denied:
+        return denied
+    
+    user_id = session['user_id']
+    is_admin = session['is_admin']
+    next_before = None
+    etag = None
+    
+    if is_admin:
+        try:
+            filters = parse_admin_filters(request.params)
+        except ValueError:
+            return error(400, 'Некорректные параметры фильтра')
         
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        requests, next_before = fetch_admin_page(request.cursor, filters)
+    else:
+        etag = current_etag(request.cursor, user_id)
+        if etag and is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
         
-        if method == 'GET':
-            if not user_id:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Требуется авторизация'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("SELECT is_admin FROM users WHERE id = %s", (user_id,))
-            user = cursor.fetchone()
-            is_admin = user and user['is_admin']
-            
-            if is_admin:
-                cursor.execute("""
-                    SELECT 
-                        wr.*,
-                        u.username,
-                        u.email,
-                        admin_user.username as processed_by_name
-                    FROM withdrawal_requests wr
-                    JOIN users u ON wr.user_id = u.id
-                    LEFT JOIN users admin_user ON wr.processed_by = admin_user.id
-                    ORDER BY 
-                        CASE wr.status 
-                            WHEN 'pending' THEN 1 
-                            WHEN 'approved' THEN 2 
-                            ELSE 3 
-                        END,
-                        wr.created_at DESC
-                """)
-            else:
-                cursor.execute("""
-                    SELECT * FROM withdrawal_requests
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            
-            requests = cursor.fetchall()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'requests': [dict(r) for r in requests],
-                    'is_admin': is_admin
-                }, default=str),
-                'isBase64Encoded': False
-            }
+        request.cursor.execute("""
+            SELECT * FROM withdrawal_requests
+            WHERE user_id = %s
+            ORDER BY created_at DESC
+        """, (user_id,))
         
-        elif method == 'POST':
-            if not user_id:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Требуется авторизация'}),
-                    'isBase64Encoded': False
-                }
-            
-            body = json.loads(event.get('body', '{}'))
-            amount = body.get('amount')
-            payment_method = body.get('payment_method', '').strip()
-            payment_details = body.get('payment_details', '').strip()
-            
-            if not amount or not payment_method or not payment_details:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Заполните все поля'}),
-                    'isBase64Encoded': False
-                }
-            
-            try:
-                amount = float(amount)
-                if amount <= 0:
-                    raise ValueError()
-            except:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Некорректная сумма'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
-            user = cursor.fetchone()
-            
-            if not user or user['balance'] < amount:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Недостаточно средств'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                INSERT INTO withdrawal_requests (user_id, amount, payment_method, payment_details, status)
-                VALUES (%s, %s, %s, %s, 'pending')
-                RETURNING id, created_at
-            """, (user_id, amount, payment_method, payment_details))
-            
-            new_request = cursor.fetchone()
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'request_id': new_request['id'],
-                    'message': 'Заявка на вывод создана'
-                }, default=str),
-                'isBase64Encoded': False
-            }
+        requests = request.cursor.fetchall()
+    
+    return respond(200, {
+        'requests': requests,
+        'is_admin': is_admin,
+        'next_before': next_before
+    }, etag_headers(etag))
+
+
+@router.route('POST')
+def create_request(request: Request) -> Dict[str, Any]:
+    session, denied = sessions.require(request)
+    if denied:
+        return denied
+    
+    user_id = session['user_id']
+    body = request.body
+    amount = body.get('amount')
+    payment_method = body.get('payment_method', '').strip()
+    payment_details = body.get('payment_details', '').strip()
+    
+    if not amount or not payment_method or not payment_details:
+        return error(400, 'Заполните все поля')
+    
+    try:
+        amount = float(amount)
+        if amount <= 0:
+            raise ValueError()
+    except:
+        return error(400, 'Некорректная сумма')
+    
+    cursor = request.cursor
+    idempotency_key = idempotency.get_key(request.event)
+    idempotency_scope = f'withdrawals:{user_id}'
+    if idempotency_key:
+        cached = idempotency.replay(cursor, idempotency_scope, idempotency_key) \
+            or idempotency.reserve(cursor, idempotency_scope, idempotency_key)
+        if cached:
+            return cached
+    
+    # Сначала блокировка строки пользователя, затем проверка и резерв отдельным оператором:
+    # он берёт новый снимок, в котором balance и balance_deltas согласованы. В одном операторе
+    # сумма balance_deltas бралась бы из старого снимка, а balance после ожидания блокировки -
+    # уже со свёрнутыми fold_balance_deltas() изменениями, и они учитывались бы дважды
+    cursor.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,))
+    cursor.execute("""
+        WITH hold AS (
+            UPDATE users
+            SET balance = balance - %(amount)s, held_balance = held_balance + %(amount)s
+            WHERE id = %(user_id)s
+              AND balance + COALESCE((SELECT SUM(balance_delta) FROM balance_deltas WHERE user_id = %(user_id)s), 0)
+                  >= %(amount)s
+            RETURNING id
+        )
+        INSERT INTO withdrawal_requests (user_id, amount, payment_method, payment_details, status)
+        SELECT id, %(amount)s, %(payment_method)s, %(payment_details)s, 'pending'
+        FROM hold
+        RETURNING id, created_at
+    """, {
+        'user_id': user_id,
+        'amount': amount,
+        'payment_method': payment_method,
+        'payment_details': payment_details,
+    })
+    
+    new_request = cursor.fetchone()
+    
+    if not new_request:
+        return error(400, 'Недостаточно средств')
+    
+    response = respond(200, {
+        'success': True,
+        'request_id': new_request['id'],
+        'message': 'Заявка на вывод создана'
+    })
+    
+    if idempotency_key:
+        idempotency.remember(cursor, idempotency_scope, idempotency_key, response)
+    request.conn.commit()
+    
+    return response
+
+
+@router.route('PUT', 'claim', 'release')
+def claim_or_release(request: Request) -> Dict[str, Any]:
+    session, denied = sessions.require(request, admin=True)
+    if denied:
+        return denied
+    
+    body = request.body
+    action = request.action
+    try:
+        if action == 'claim':
+            status = body.get('status', 'pending')
+            if status not in CLAIM_STATUSES:
+                raise ValueError('status')
+            limit = min(max(int(body.get('limit', CLAIM_DEFAULT_LIMIT)), 1), CLAIM_MAX_LIMIT)
+            lease = min(max(int(body.get('lease_seconds', CLAIM_DEFAULT_LEASE)), 1), CLAIM_MAX_LEASE)
+        else:
+            request_ids = [int(i) for i in body.get('request_ids') or []]
+    except (TypeError, ValueError):
+        return error(400, 'Некорректные данные')
+    
+    if action == 'claim':
+        claimed = claim_requests(request.cursor, session['user_id'], status, limit, lease)
+        payload = {'success': True, 'requests': claimed}
+    else:
+        payload = {'success': True, 'released': release_requests(request.cursor, session['user_id'], request_ids)}
+    request.conn.commit()
+    
+    return respond(200, payload)
+
+
+@router.route('PUT')
+def update_requests(request: Request) -> Dict[str, Any]:
+    session, denied = sessions.require(request, admin=True)
+    if denied:
+        return denied
+    
+    body = request.body
+    if 'items' in body:
+        items = body.get('items') or []
+        if not isinstance(items, list) or len(items) > BATCH_MAX_ITEMS:
+            return error(400, 'Некорректные данные')
         
-        elif method == 'PUT':
-            if not user_id:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Требуется авторизация'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("SELECT is_admin FROM users WHERE id = %s", (user_id,))
-            user = cursor.fetchone()
-            
-            if not user or not user['is_admin']:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Доступ запрещён'}),
-                    'isBase64Encoded': False
-                }
-            
-            body = json.loads(event.get('body', '{}'))
-            request_id = body.get('request_id')
-            new_status = body.get('status')
-            admin_comment = body.get('admin_comment', '')
-            
-            if not request_id or new_status not in ['approved', 'rejected', 'completed']:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Некорректные данные'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                SELECT wr.*, u.balance 
-                FROM withdrawal_requests wr
-                JOIN users u ON wr.user_id = u.id
-                WHERE wr.id = %s
-            """, (request_id,))
-            
-            withdrawal = cursor.fetchone()
-            
-            if not withdrawal:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Заявка не найдена'}),
-                    'isBase64Encoded': False
-                }
-            
-            if new_status == 'completed':
-                if withdrawal['status'] != 'approved':
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Заявка должна быть сначала одобрена'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute("""
-                    UPDATE users 
-                    SET balance = balance - %s
-                    WHERE id = %s AND balance >= %s
-                """, (withdrawal['amount'], withdrawal['user_id'], withdrawal['amount']))
-                
-                if cursor.rowcount == 0:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Недостаточно средств у пользователя'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute("""
-                    INSERT INTO transactions (user_id, type, amount, description)
-                    VALUES (%s, 'withdrawal', -%s, %s)
-                """, (withdrawal['user_id'], withdrawal['amount'], f"Вывод средств #{request_id}"))
-            
-            cursor.execute("""
-                UPDATE withdrawal_requests
-                SET status = %s, admin_comment = %s, processed_at = %s, processed_by = %s
-                WHERE id = %s
-            """, (new_status, admin_comment, datetime.now(), user_id, request_id))
-            
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'message': f'Статус изменён на {new_status}'
-                }),
-                'isBase64Encoded': False
-            }
+        results = process_requests(request.cursor, session['user_id'], items)
+        request.conn.commit()
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+        return respond(200, {
+            'success': True,
+            'results': results,
+            'processed': sum(1 for r in results if r['result'] == 'ok')
+        })
     
-    except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+    request_id = body.get('request_id')
+    new_status = body.get('status')
+    admin_comment = body.get('admin_comment', '')
+    
+    if not request_id or new_status not in PROCESS_STATUSES:
+        return error(400, 'Некорректные данные')
+    
+    result = process_requests(request.cursor, session['user_id'], [{
+        'request_id': request_id,
+        'status': new_status,
+        'admin_comment': admin_comment
+    }])[0]['result']
+    
+    if result != 'ok':
+        return error(*PROCESS_ERRORS[result])
+    
+    request.conn.commit()
+    
+    return respond(200, {
+        'success': True,
+        'message': f'Статус изменён на {new_status}'
+    })
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return router(event, context)
@@ -0,0 +1,65 @@
+"""
+Business: Версия данных пользователя для условных GET-запросов (ETag / If-None-Match)
+Args: курсор, id пользователя, заголовки запроса
+Returns: ETag из user_data_versions и готовый ответ 304; версию увеличивают триггеры
+         на referral_earnings, transactions и withdrawal_requests, поэтому проверка
+         обходится одной выборкой по первичному ключу без агрегатов
+"""
+
+from typing import Any, Dict, Optional
+
+CACHE_HEADERS = {
+    'Cache-Control': 'private, no-cache',
+    'Access-Control-Expose-Headers': 'ETag'
+}
+
+
+def fetch_data_version(cursor, user_id) -> Optional[int]:
+    """Версия из user_data_versions (0, пока данные не менялись); None - пользователь не найден"""
+    cursor.execute("""
+        SELECT COALESCE(v.version, 0) AS data_version
+        FROM users u
+        LEFT JOIN user_data_versions v ON v.user_id = u.id
+        WHERE u.id = %s
+    """, (user_id,))
+    row = cursor.fetchone()
+    return row['data_version'] if row else None
+
+
+def make_etag(user_id, version: int) -> str:
+    return f'W/"{user_id}-{version}"'
+
+
+def current_etag(cursor, user_id) -> Optional[str]:
+    """ETag текущей версии данных пользователя; None - пользователь не найден"""
+    version = fetch_data_version(cursor, user_id)
+    return make_etag(user_id, version) if version is not None else None
+
+
+def etag_headers(etag: Optional[str]) -> Optional[Dict[str, str]]:
+    """Заголовки ответа с ETag для runtime.respond"""
+    return {'ETag': etag, **CACHE_HEADERS} if etag else None
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def is_not_modified(headers: Dict[str, Any], etag: str) -> bool:
+    """If-None-Match совпадает с etag: слабое сравнение, список через запятую или *"""
+    header = headers.get('If-None-Match') or headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(_opaque(tag) == _opaque(etag) for tag in header.split(','))
+
+
+def not_modified_response(etag: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {'ETag': etag, 'Access-Control-Allow-Origin': '*', **CACHE_HEADERS},
+        'body': '',
+        'isBase64Encoded': False
+    }
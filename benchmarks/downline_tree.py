@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк запросов к реферальному дереву на синтетических данных
+Строит дерево из --users пользователей (родитель выбирается со смещением к ранним
+пользователям, так что у первых - огромные ветки), заполняет referral_closure и сравнивает
+рекурсивный обход users.referred_by_id с индексными выборками из referral_closure:
+число приглашённых по глубинам и первая страница узлов дерева.
+
+Запуск: DATABASE_URL=postgres://... python benchmarks/downline_tree.py --users 1000000
+База должна быть одноразовой и с применёнными db_migrations/.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+REFERRALS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'referrals')
+
+
+def load_referrals():
+    sys.path.insert(0, REFERRALS_DIR)
+    spec = importlib.util.spec_from_file_location('referrals_index', os.path.join(REFERRALS_DIR, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_tree(conn, users: int) -> list:
+    """Вставить дерево и его замыкание; возвращает id нескольких корней с крупнейшими ветками"""
+    cursor = conn.cursor()
+    tag = uuid.uuid4().hex[:8]
+    cursor.execute("SELECT COALESCE(MAX(id), 0) + 1000 FROM users")
+    base = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO users (id, email, password_hash, username, referral_code, referred_by_id)
+        SELECT %(base)s + g, 'tree-' || %(tag)s || '-' || g || '@bench.local', 'bench', 'bench',
+               referral_code_from_id(%(base)s + g),
+               CASE WHEN g = 1 THEN NULL
+                    ELSE %(base)s + 1 + floor(power(random(), 3) * (g - 1))::int END
+        FROM generate_series(1, %(users)s) g
+    """, {'base': base, 'tag': tag, 'users': users})
+    cursor.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT MAX(id) FROM users))")
+    cursor.execute("""
+        INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE walk AS (
+            SELECT id AS descendant_id, id AS ancestor_id, referred_by_id, 0 AS depth
+            FROM users
+            WHERE id > %(base)s
+            UNION ALL
+            SELECT walk.descendant_id, u.id, u.referred_by_id, walk.depth + 1
+            FROM walk
+            JOIN users u ON u.id = walk.referred_by_id
+            WHERE walk.depth < 5
+        )
+        SELECT ancestor_id, descendant_id, depth FROM walk
+    """, {'base': base})
+    cursor.execute("ANALYZE users")
+    cursor.execute("ANALYZE referral_closure")
+    conn.commit()
+    cursor.execute("""
+        SELECT ancestor_id
+        FROM referral_closure
+        WHERE ancestor_id > %s AND depth = 1
+        GROUP BY ancestor_id
+        ORDER BY COUNT(*) DESC
+        LIMIT 3
+    """, (base,))
+    roots = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return roots
+
+
+def recursive_counts(cursor, user_id):
+    """Число приглашённых по глубинам рекурсивным обходом referred_by_id"""
+    cursor.execute("""
+        WITH RECURSIVE downline AS (
+            SELECT id, 1 AS depth FROM users WHERE referred_by_id = %s
+            UNION ALL
+            SELECT u.id, downline.depth + 1
+            FROM downline
+            JOIN users u ON u.referred_by_id = downline.id
+            WHERE downline.depth < 5
+        )
+        SELECT depth, COUNT(*) FROM downline GROUP BY depth ORDER BY depth
+    """, (user_id,))
+    return cursor.fetchall()
+
+
+def measure(conn, fetch, user_ids, iterations: int) -> dict:
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    timings = []
+    for _ in range(iterations):
+        for user_id in user_ids:
+            started = time.perf_counter()
+            fetch(cursor, user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+            conn.rollback()
+    cursor.close()
+    timings.sort()
+    return {
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(timings[len(timings) // 2], 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95)], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    referrals = load_referrals()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    started = time.perf_counter()
+    roots = build_tree(conn, args.users)
+
+    result = {
+        'users': args.users,
+        'build_seconds': round(time.perf_counter() - started, 1),
+        'measured_user_ids': roots,
+        'recursive_walk_counts': measure(conn, recursive_counts, roots, args.iterations),
+        'closure_counts': measure(conn, lambda c, u: referrals.fetch_downline_payload(c, u, 5, 0),
+                                  roots, args.iterations),
+        'closure_counts_and_first_500_nodes': measure(
+            conn, lambda c, u: referrals.fetch_downline_payload(c, u, 5, 500), roots, args.iterations),
+    }
+    conn.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
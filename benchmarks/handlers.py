@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон обработчиков функций auth, referrals и withdrawals на локальной базе
+Применяет db_migrations/ (если таблиц ещё нет), заводит пользователей с сессиями, администратора
+и очередь заявок, затем вызывает handler каждой функции в --concurrency потоков по сценариям:
+register, login, referral_stats, withdrawal_create, withdrawal_list, withdrawal_process.
+Печатает JSON с p50/p95/p99, пропускной способностью, кодами ответов и числом запросов к базе
+на вызов, чтобы сравнивать прогоны между коммитами.
+
+Запуск: DATABASE_URL=postgres://... python benchmarks/handlers.py --users 10000 --requests 2000 --concurrency 8
+База должна быть одноразовой.
+"""
+
+import argparse
+import glob
+import hashlib
+import importlib.util
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BACKEND_DIR = os.path.join(ROOT, 'backend')
+MIGRATIONS_DIR = os.path.join(ROOT, 'db_migrations')
+FUNCTION_MODULES = ('db', 'runtime', 'sessions', 'versioning', 'idempotency', 'export')
+SCENARIOS = ('register', 'login', 'referral_stats', 'withdrawal_create', 'withdrawal_list', 'withdrawal_process')
+PASSWORD = 'bench-password'
+
+_statements = threading.local()
+
+
+class CountingCursor(RealDictCursor):
+    """RealDictCursor, считающий выполненные запросы в текущем потоке"""
+
+    def execute(self, query, vars=None):
+        _statements.count = getattr(_statements, 'count', 0) + 1
+        return super().execute(query, vars)
+
+
+def load_function(name: str):
+    """Загрузить index.py функции со своими копиями db/runtime/...: у каждой функции свой пул,
+    как у отдельного контейнера"""
+    function_dir = os.path.join(BACKEND_DIR, name)
+    for shared in FUNCTION_MODULES:
+        sys.modules.pop(shared, None)
+    sys.path.insert(0, function_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(function_dir, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['runtime'].RealDictCursor = CountingCursor
+    finally:
+        sys.path.remove(function_dir)
+        for shared in FUNCTION_MODULES:
+            sys.modules.pop(shared, None)
+    return module
+
+
+def apply_migrations(conn) -> list:
+    """Применить db_migrations/ по порядку, если схемы ещё нет; возвращает применённые файлы"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('users') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        cursor.close()
+        return []
+    applied = []
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+        with open(path, encoding='utf-8') as f:
+            cursor.execute(f.read())
+        applied.append(os.path.basename(path))
+    conn.commit()
+    cursor.close()
+    return applied
+
+
+def session_token(tag: str, user_id: int) -> str:
+    return f'bench-{tag}-{user_id}'
+
+
+def seed(conn, users: int, pending: int) -> dict:
+    """Пользователи с рефералами, сессиями и балансом, администратор и pending-заявки"""
+    cursor = conn.cursor()
+    tag = uuid.uuid4().hex[:8]
+    password_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) + 1000 FROM users")
+    base = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO users (id, email, password_hash, username, referral_code, referred_by_id, balance, is_admin)
+        SELECT %(base)s + g, 'handlers-' || %(tag)s || '-' || g || '@bench.local', %(password_hash)s, 'bench',
+               referral_code_from_id(%(base)s + g),
+               CASE WHEN g = 1 THEN NULL ELSE %(base)s + 1 + floor(power(random(), 2) * (g - 1))::int END,
+               1000000, g = 1
+        FROM generate_series(1, %(users)s) g
+    """, {'base': base, 'tag': tag, 'password_hash': password_hash, 'users': users})
+    cursor.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT MAX(id) FROM users))")
+    cursor.execute("""
+        INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE walk AS (
+            SELECT id AS descendant_id, id AS ancestor_id, referred_by_id, 0 AS depth
+            FROM users
+            WHERE id > %(base)s
+            UNION ALL
+            SELECT walk.descendant_id, u.id, u.referred_by_id, walk.depth + 1
+            FROM walk
+            JOIN users u ON u.id = walk.referred_by_id
+            WHERE walk.depth < 5
+        )
+        SELECT ancestor_id, descendant_id, depth FROM walk
+    """, {'base': base})
+    cursor.execute("""
+        INSERT INTO sessions (token_hash, user_id, is_admin, expires_at)
+        SELECT encode(sha256(convert_to('bench-' || %(tag)s || '-' || id, 'UTF8')), 'hex'), id, is_admin,
+               CURRENT_TIMESTAMP + INTERVAL '1 day'
+        FROM users
+        WHERE id > %(base)s
+    """, {'base': base, 'tag': tag})
+    cursor.execute("""
+        WITH picked AS (
+            SELECT %(base)s + 2 + floor(random() * (%(users)s - 1))::int AS user_id
+            FROM generate_series(1, %(pending)s)
+        ),
+        created AS (
+            INSERT INTO withdrawal_requests (user_id, amount, payment_method, payment_details, status)
+            SELECT user_id, 1.00, 'card', 'bench', 'pending' FROM picked
+            RETURNING id, user_id, amount
+        ),
+        held AS (
+            UPDATE users
+            SET balance = users.balance - totals.amount, held_balance = users.held_balance + totals.amount
+            FROM (SELECT user_id, SUM(amount) AS amount FROM created GROUP BY user_id) totals
+            WHERE users.id = totals.user_id
+        )
+        SELECT id FROM created ORDER BY id
+    """, {'base': base, 'users': users, 'pending': pending})
+    pending_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT id, referral_code FROM users WHERE id > %s", (base,))
+    referral_codes = dict(cursor.fetchall())
+    cursor.execute("ANALYZE")
+    conn.commit()
+    cursor.close()
+    return {
+        'tag': tag,
+        'base': base,
+        'admin_id': base + 1,
+        'user_ids': list(range(base + 2, base + users + 1)),
+        'pending_ids': pending_ids,
+        'referral_codes': referral_codes,
+    }
+
+
+def build_scenarios(functions: dict, seeded: dict) -> dict:
+    """Фабрики event для каждого сценария: (handler, функция, возвращающая event)"""
+    tag = seeded['tag']
+    user_ids = seeded['user_ids']
+    admin_token = session_token(tag, seeded['admin_id'])
+    pending_ids = iter(seeded['pending_ids'])
+    pending_lock = threading.Lock()
+    registrations = itertools.count()
+
+    def auth_headers(user_id):
+        return {'X-Auth-Token': session_token(tag, user_id)}
+
+    def register():
+        n = next(registrations)
+        return {'httpMethod': 'POST', 'headers': {}, 'body': json.dumps({
+            'action': 'register',
+            'email': f'handlers-{tag}-new-{n}@bench.local',
+            'password': PASSWORD,
+            'username': 'bench',
+            'referral_code': seeded['referral_codes'][random.choice(user_ids)],
+        })}
+
+    def login():
+        return {'httpMethod': 'POST', 'headers': {}, 'body': json.dumps({
+            'action': 'login',
+            'email': f'handlers-{tag}-{random.choice(user_ids) - seeded["base"]}@bench.local',
+            'password': PASSWORD,
+        })}
+
+    def referral_stats():
+        return {'httpMethod': 'GET', 'headers': auth_headers(random.choice(user_ids))}
+
+    def withdrawal_create():
+        return {'httpMethod': 'POST', 'headers': auth_headers(random.choice(user_ids)), 'body': json.dumps({
+            'amount': 1,
+            'payment_method': 'card',
+            'payment_details': 'bench',
+        })}
+
+    def withdrawal_list():
+        return {'httpMethod': 'GET', 'headers': auth_headers(random.choice(user_ids))}
+
+    def withdrawal_process():
+        with pending_lock:
+            request_id = next(pending_ids, None)
+        return {'httpMethod': 'PUT', 'headers': {'X-Auth-Token': admin_token}, 'body': json.dumps({
+            'request_id': request_id or 0,
+            'status': 'approved',
+        })}
+
+    return {
+        'register': (functions['auth'].handler, register),
+        'login': (functions['auth'].handler, login),
+        'referral_stats': (functions['referrals'].handler, referral_stats),
+        'withdrawal_create': (functions['withdrawals'].handler, withdrawal_create),
+        'withdrawal_list': (functions['withdrawals'].handler, withdrawal_list),
+        'withdrawal_process': (functions['withdrawals'].handler, withdrawal_process),
+    }
+
+
+def run_scenario(handler, make_event, requests: int, concurrency: int) -> dict:
+    def call(_):
+        event = make_event()
+        _statements.count = 0
+        started = time.perf_counter()
+        response = handler(event, None)
+        return (time.perf_counter() - started) * 1000, response['statusCode'], _statements.count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(r[0] for r in results)
+    return {
+        'requests': requests,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(timings[int(len(timings) * 0.50)], 3),
+        'p95_ms': round(timings[min(int(len(timings) * 0.95), len(timings) - 1)], 3),
+        'p99_ms': round(timings[min(int(len(timings) * 0.99), len(timings) - 1)], 3),
+        'queries_per_request': round(statistics.mean(r[2] for r in results), 2),
+        'status_codes': dict(Counter(str(r[1]) for r in results)),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--requests', type=int, default=2000, help='вызовов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--output', help='дополнительно записать результат в файл')
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error('нужно хотя бы 2 пользователя: администратор и клиент')
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'неизвестные сценарии: {", ".join(sorted(unknown))}')
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    migrations = apply_migrations(conn)
+    seeded = seed(conn, args.users, args.requests if 'withdrawal_process' in scenarios else 0)
+    conn.close()
+
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.concurrency))
+    functions = {name: load_function(name) for name in ('auth', 'referrals', 'withdrawals')}
+    table = build_scenarios(functions, seeded)
+
+    result = {
+        'revision': git_revision(),
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'migrations_applied': migrations,
+        'scenarios': {},
+    }
+    for name in scenarios:
+        handler, make_event = table[name]
+        result['scenarios'][name] = run_scenario(handler, make_event, args.requests, args.concurrency)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк конкуренции за строки верхних рефереров
+N параллельных «регистраций» под одной цепочкой из 5 предков:
+  before - каждая регистрация делает UPDATE users по всем предкам (как старый create_referral_chain);
+  after  - каждая регистрация добавляет строки в balance_deltas, свёртка выполняется в конце.
+Печатает пропускную способность и проверяет, что итоговые балансы совпали.
+
+Запуск: DATABASE_URL=postgres://... python benchmarks/hot_row_contention.py --workers 32 --per-worker 200
+База должна быть одноразовой и с применёнными db_migrations/.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from decimal import Decimal
+import psycopg2
+
+REFERRAL_LEVELS = {
+    1: 0.10,
+    2: 0.05,
+    3: 0.03,
+    4: 0.02,
+    5: 0.01
+}
+
+REGISTRATION_BONUS = 100.0
+
+
+def create_chain(conn) -> list:
+    """Цепочка из 5 пользователей; возвращает id от ближайшего предка к самому верхнему"""
+    cursor = conn.cursor()
+    tag = uuid.uuid4().hex[:8]
+    parent_id = None
+    ids = []
+    for depth in range(len(REFERRAL_LEVELS)):
+        cursor.execute("""
+            WITH new_id AS (SELECT nextval(pg_get_serial_sequence('users', 'id')) AS id)
+            INSERT INTO users (id, email, password_hash, username, referral_code, referred_by_id)
+            SELECT id, %s, 'bench', 'bench', referral_code_from_id(id), %s FROM new_id
+            RETURNING id
+        """, (f'hot-{tag}-{depth}@bench.local', parent_id))
+        parent_id = cursor.fetchone()[0]
+        ids.append(parent_id)
+    conn.commit()
+    cursor.close()
+    return list(reversed(ids))
+
+
+def pay_direct(cursor, ancestors):
+    for level, user_id in enumerate(ancestors, start=1):
+        amount = REGISTRATION_BONUS * REFERRAL_LEVELS[level]
+        cursor.execute("""
+            UPDATE users
+            SET balance = balance + %s, total_earned = total_earned + %s
+            WHERE id = %s
+        """, (amount, amount, user_id))
+
+
+def pay_deltas(cursor, ancestors):
+    amounts = [REGISTRATION_BONUS * REFERRAL_LEVELS[level] for level in range(1, len(ancestors) + 1)]
+    cursor.execute("""
+        INSERT INTO balance_deltas (user_id, balance_delta, earned_delta)
+        SELECT user_id, amount, amount FROM unnest(%s::int[], %s::numeric[]) AS t(user_id, amount)
+    """, (ancestors, amounts))
+
+
+def run(pay, ancestors, workers: int, per_worker: int) -> dict:
+    barrier = threading.Barrier(workers + 1)
+    errors = []
+
+    def worker():
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cursor = conn.cursor()
+        barrier.wait()
+        try:
+            for _ in range(per_worker):
+                pay(cursor, ancestors)
+                conn.commit()
+        except Exception as e:
+            errors.append(str(e))
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'registrations': workers * per_worker,
+        'seconds': round(elapsed, 3),
+        'registrations_per_second': round(workers * per_worker / elapsed, 1),
+        'errors': errors[:5],
+    }
+
+
+def balances(conn, ancestors) -> list:
+    cursor = conn.cursor()
+    cursor.execute("SELECT fold_balance_deltas()")
+    cursor.execute("SELECT id, balance FROM users WHERE id = ANY(%s) ORDER BY id", (ancestors,))
+    rows = cursor.fetchall()
+    conn.commit()
+    cursor.close()
+    return [balance for _, balance in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--per-worker', type=int, default=200)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    direct_chain = create_chain(conn)
+    deltas_chain = create_chain(conn)
+
+    result = {
+        'workers': args.workers,
+        'before_direct_update': run(pay_direct, direct_chain, args.workers, args.per_worker),
+        'after_balance_deltas': run(pay_deltas, deltas_chain, args.workers, args.per_worker),
+    }
+    expected = [
+        Decimal(str(REGISTRATION_BONUS * rate)) * args.workers * args.per_worker
+        for rate in REFERRAL_LEVELS.values()
+    ]
+    result['balances_match'] = sorted(balances(conn, direct_chain)) == sorted(balances(conn, deltas_chain)) \
+        == sorted(expected)
+    conn.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк сериализации списка заявок для администратора
+Строит --rows строк в форме ответа fetch_admin_page (Decimal, datetime, строки) и сравнивает
+json.dumps(..., default=str), как было в обработчиках, с runtime.dumps на orjson и с запасной
+реализацией runtime.dumps на стандартном json. База не нужна.
+
+Запуск: python benchmarks/json_encoding.py --rows 10000
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+WITHDRAWALS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'withdrawals')
+
+
+def load_runtime(with_orjson: bool):
+    sys.path.insert(0, WITHDRAWALS_DIR)
+    saved = sys.modules.get('orjson')
+    if not with_orjson:
+        sys.modules['orjson'] = None
+    try:
+        spec = importlib.util.spec_from_file_location('withdrawals_runtime', os.path.join(WITHDRAWALS_DIR, 'runtime.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        if not with_orjson:
+            if saved is None:
+                sys.modules.pop('orjson', None)
+            else:
+                sys.modules['orjson'] = saved
+    return module
+
+
+def make_rows(count: int) -> list:
+    started = datetime(2024, 1, 1)
+    statuses = ('pending', 'approved', 'rejected', 'completed')
+    rows = []
+    for i in range(count):
+        created_at = started + timedelta(seconds=random.randint(0, 365 * 86400), microseconds=random.randint(0, 999999))
+        processed = i % 3 == 0
+        rows.append({
+            'id': i + 1,
+            'user_id': random.randint(1, 100000),
+            'amount': Decimal(random.randint(100, 1000000)) / 100,
+            'payment_method': random.choice(('card', 'qiwi', 'yoomoney')),
+            'payment_details': f'4276 **** **** {i % 10000:04d}',
+            'status': random.choice(statuses),
+            'admin_comment': 'Проверено' if processed else None,
+            'created_at': created_at,
+            'processed_at': created_at + timedelta(hours=2) if processed else None,
+            'processed_by': 1 if processed else None,
+            'claimed_by': None,
+            'claimed_until': None,
+            'username': f'user{i}',
+            'email': f'user{i}@example.com',
+            'processed_by_name': 'admin' if processed else None,
+        })
+    return rows
+
+
+def measure(encode, payload, iterations: int) -> dict:
+    encode(payload)
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        body = encode(payload)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(timings[len(timings) // 2], 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95)], 3),
+        'bytes': len(body.encode()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(1)
+    payload = {'requests': make_rows(args.rows), 'is_admin': True, 'next_before': None}
+    fast = load_runtime(with_orjson=True)
+    fallback = load_runtime(with_orjson=False)
+
+    result = {
+        'rows': args.rows,
+        'orjson_available': fast.orjson is not None,
+        'json_dumps_default_str': measure(lambda p: json.dumps(p, default=str), payload, args.iterations),
+        'runtime_dumps_stdlib': measure(fallback.dumps, payload, args.iterations),
+        'runtime_dumps': measure(fast.dumps, payload, args.iterations),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Свод профилей обработчиков, записанных при HANDLER_PROFILE_RATE > 0
+Объединяет *.pstats из каталога (по умолчанию HANDLER_PROFILE_DIR или /tmp/handler-profiles),
+печатает самые дорогие функции и по желанию сохраняет объединённый .pstats (snakeviz, gprof2dot)
+и свёрнутые стеки для flamegraph.pl / speedscope. cProfile хранит только пары вызывающий -> вызываемый,
+поэтому стеки восстанавливаются по графу вызовов: время функции делится между вызывающими
+пропорционально их доле в её полном времени.
+
+Запуск: python benchmarks/profiles.py /tmp/handler-profiles --pattern 'withdrawals-POST-*' \\
+            --collapsed withdrawals.folded && flamegraph.pl withdrawals.folded > withdrawals.svg
+"""
+
+import argparse
+import glob
+import os
+import pstats
+import sys
+from collections import defaultdict
+
+MAX_STACK_DEPTH = 64
+MIN_COLLAPSED_MICROSECONDS = 1
+
+
+def frame_label(func) -> str:
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return f'{os.path.basename(filename)}:{name}:{line}'
+
+
+def collapsed_stacks(stats: pstats.Stats) -> dict:
+    """Свёрнутые стеки {'a;b;c': микросекунды собственного времени c на этом пути}"""
+    children = defaultdict(dict)
+    roots = []
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, cumtime) in callers.items():
+            children[caller][func] = cumtime
+
+    stacks = defaultdict(int)
+
+    def walk(func, path, fraction):
+        tottime = stats.stats[func][2]
+        path = path + (frame_label(func),)
+        own = round(tottime * fraction * 1_000_000)
+        if own >= MIN_COLLAPSED_MICROSECONDS:
+            stacks[';'.join(path)] += own
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for child, edge_cumtime in children[func].items():
+            child_cumtime = stats.stats[child][3]
+            if not child_cumtime or frame_label(child) in path:
+                continue
+            child_fraction = fraction * min(edge_cumtime / child_cumtime, 1.0)
+            if child_cumtime * child_fraction * 1_000_000 >= MIN_COLLAPSED_MICROSECONDS:
+                walk(child, path, child_fraction)
+
+    for root in roots:
+        walk(root, (), 1.0)
+    return stacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=os.environ.get('HANDLER_PROFILE_DIR', '/tmp/handler-profiles'))
+    parser.add_argument('--pattern', default='*.pstats', help='маска файлов, например referrals-GET-*')
+    parser.add_argument('--sort', default='cumulative', choices=('cumulative', 'tottime', 'ncalls'))
+    parser.add_argument('--limit', type=int, default=30, help='сколько функций напечатать')
+    parser.add_argument('--output', help='сохранить объединённый профиль в .pstats')
+    parser.add_argument('--collapsed', help='сохранить свёрнутые стеки для flamegraph.pl')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.directory, args.pattern)))
+    if not paths:
+        parser.error(f'в {args.directory} нет профилей по маске {args.pattern}')
+
+    stats = pstats.Stats(paths[0], stream=sys.stdout)
+    for path in paths[1:]:
+        stats.add(path)
+
+    if args.output:
+        stats.dump_stats(args.output)
+    if args.collapsed:
+        with open(args.collapsed, 'w', encoding='utf-8') as f:
+            for stack, microseconds in sorted(collapsed_stacks(stats).items()):
+                f.write(f'{stack} {microseconds}\n')
+
+    print(f'профилей: {len(paths)}, на вызов: {stats.total_tt / len(paths) * 1000:.3f} мс')
+    stats.files = []
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк выдачи реферальных кодов на большой таблице пользователей
+Сравнивает старую схему (случайный код + SELECT-проверка в цикле + INSERT)
+с кодом из referral_code_from_id(id) прямо в INSERT.
+
+Запуск: DATABASE_URL=postgres://... python benchmarks/referral_codes.py --existing 10000000
+База должна быть одноразовой и с применёнными db_migrations/; таблицы создаются как TEMP.
+"""
+
+import argparse
+import json
+import os
+import secrets
+import statistics
+import string
+import time
+import psycopg2
+
+CODE_CHARS = string.ascii_uppercase + string.digits
+CODE_LENGTH = 8
+
+# Те же CODE_CHARS и CODE_LENGTH, что у random_code: иначе проверка в цикле почти никогда
+# не совпадает с существующими кодами и доля коллизий занижена. Подзапрос ссылается на g,
+# чтобы код вычислялся для каждой строки, а не один раз
+RANDOM_CODE_SQL = """(
+    SELECT string_agg(substr(%(chars)s, 1 + floor(random() * length(%(chars)s))::int, 1), '')
+    FROM generate_series(1, %(length)s)
+    WHERE g IS NOT NULL
+)"""
+
+
+def random_code(length=CODE_LENGTH):
+    return ''.join(secrets.choice(CODE_CHARS) for _ in range(length))
+
+
+def prepare(cursor, existing: int):
+    """Две временные таблицы по existing строк с уникальным индексом по коду. Случайные коды
+    могут совпасть, повторы отбрасываются, поэтому в первой таблице строк может быть чуть меньше"""
+    for table, code_expr in (
+        ('bench_random_codes', RANDOM_CODE_SQL),
+        ('bench_encoded_codes', "referral_code_from_id(g)"),
+    ):
+        cursor.execute(f"""
+            CREATE TEMP TABLE {table} (
+                id SERIAL PRIMARY KEY,
+                referral_code VARCHAR(20) NOT NULL
+            )
+        """)
+        cursor.execute(f"""
+            INSERT INTO {table} (id, referral_code)
+            SELECT DISTINCT ON (code) g, code
+            FROM (SELECT g, {code_expr} AS code FROM generate_series(1, %(existing)s) g) generated
+        """, {'existing': existing, 'chars': CODE_CHARS, 'length': CODE_LENGTH})
+        cursor.execute(f"CREATE UNIQUE INDEX ON {table} (referral_code)")
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), %s)", (existing,))
+        cursor.execute(f"ANALYZE {table}")
+
+
+def allocate_random(cursor):
+    """Старая схема: проверка кода SELECT-ом до тех пор, пока не найдётся свободный"""
+    round_trips = 0
+    code = random_code()
+    while True:
+        cursor.execute("SELECT id FROM bench_random_codes WHERE referral_code = %s", (code,))
+        round_trips += 1
+        if not cursor.fetchone():
+            break
+        code = random_code()
+    cursor.execute("INSERT INTO bench_random_codes (referral_code) VALUES (%s)", (code,))
+    return round_trips + 1
+
+
+def allocate_encoded(cursor):
+    """Новая схема: код вычисляется из id в том же INSERT"""
+    cursor.execute("""
+        WITH new_row AS (
+            SELECT nextval(pg_get_serial_sequence('bench_encoded_codes', 'id')) AS id
+        )
+        INSERT INTO bench_encoded_codes (id, referral_code)
+        SELECT id, referral_code_from_id(id) FROM new_row
+    """)
+    return 1
+
+
+def measure(conn, allocate, iterations: int):
+    cursor = conn.cursor()
+    timings = []
+    round_trips = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        round_trips += allocate(cursor)
+        conn.commit()
+        timings.append((time.perf_counter() - started) * 1000)
+    cursor.close()
+    timings.sort()
+    return {
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(timings[len(timings) // 2], 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95)], 3),
+        'round_trips_per_allocation': round(round_trips / iterations, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--existing', type=int, default=10_000_000, help='сколько пользователей уже в таблице')
+    parser.add_argument('--iterations', type=int, default=2000, help='сколько кодов выдать каждой схемой')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    prepare(cursor, args.existing)
+    conn.commit()
+    cursor.close()
+
+    result = {
+        'existing_users': args.existing,
+        'iterations': args.iterations,
+        'prepare_seconds': round(time.perf_counter() - started, 1),
+        'select_retry_loop': measure(conn, allocate_random, args.iterations),
+        'id_encoded': measure(conn, allocate_encoded, args.iterations),
+    }
+    conn.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетического реферального графа для нагрузочных прогонов
+Строит --users пользователей: родитель выбирается смешанной моделью предпочтительного
+присоединения, поэтому число приглашённых распределено по степенному закону с показателем
+--alpha (несколько рефереров с огромными ветками, длинный хвост без приглашённых), глубина
+дерева ограничена --max-depth. Начисления считаются по REFERRAL_LEVELS и REGISTRATION_BONUS
+из backend/payouts, заявки на вывод удерживают или списывают баланс так же, как функция
+withdrawals, поэтому обработчики на сгенерированных данных возвращают верные суммы.
+
+Загружает users, referral_closure, referral_earnings, transactions и withdrawal_requests
+через COPY потоком, без промежуточных файлов; referral_stats собирается одним запросом.
+
+Запуск: DATABASE_URL=postgres://... python benchmarks/referral_graph.py --users 1000000
+База должна быть одноразовой и с применёнными db_migrations/.
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from array import array
+from datetime import datetime, timedelta
+import psycopg2
+
+PAYOUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'payouts')
+WITHDRAWAL_STATUSES = ('pending', 'approved', 'rejected', 'completed')
+COPY_READ_SIZE = 1 << 20
+CODE_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+def load_payouts():
+    sys.path.insert(0, PAYOUTS_DIR)
+    spec = importlib.util.spec_from_file_location('payouts_index', os.path.join(PAYOUTS_DIR, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def referral_code_from_id(user_id: int) -> str:
+    """То же, что SQL-функция referral_code_from_id (db_migrations/V0002): COPY не вызывает функции"""
+    n = (user_id * 1580030173 + 29943717) % 78364164096
+    code = []
+    for _ in range(7):
+        code.append(CODE_ALPHABET[n % 36])
+        n //= 36
+    return ''.join(reversed(code))
+
+
+class LineStream:
+    """Файлоподобный объект для copy_expert поверх генератора строк"""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ''
+        self.rows = 0
+
+    def read(self, size: int = COPY_READ_SIZE) -> str:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+            if length >= size:
+                break
+        data = ''.join(chunks)
+        self._buffer = data[size:]
+        return data[:size]
+
+    readline = read
+
+
+def build_tree(users: int, alpha: float, max_depth: int, root_fraction: float):
+    """Родитель (индекс или -1) и глубина каждого пользователя. С вероятностью 1 / (alpha - 1)
+    родитель копируется у случайного уже приглашённого (выбор пропорционально числу
+    приглашённых), иначе выбирается равномерно; это даёт степенной хвост с показателем alpha."""
+    copy_probability = min(1.0 / (alpha - 1.0), 1.0)
+    parents = array('i', [-1]) if users else array('i')
+    depths = array('b', [0]) if users else array('b')
+    invited = array('i')
+    for i in range(1, users):
+        if random.random() < root_fraction:
+            parent = -1
+        elif invited and random.random() < copy_probability:
+            parent = parents[invited[random.randrange(len(invited))]]
+        else:
+            parent = random.randrange(i)
+        while parent >= 0 and depths[parent] >= max_depth:
+            parent = parents[parent]
+        parents.append(parent)
+        depths.append(depths[parent] + 1 if parent >= 0 else 0)
+        if parent >= 0:
+            invited.append(i)
+    return parents, depths
+
+
+def ancestors(parents, i: int, levels: int):
+    parent = parents[i]
+    level = 1
+    while parent >= 0 and level <= levels:
+        yield level, parent
+        parent = parents[parent]
+        level += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--alpha', type=float, default=2.2, help='показатель степенного закона числа приглашённых (> 2)')
+    parser.add_argument('--max-depth', type=int, default=12, help='максимальная глубина дерева')
+    parser.add_argument('--root-fraction', type=float, default=0.001, help='доля пользователей без реферера')
+    parser.add_argument('--withdrawal-fraction', type=float, default=0.2,
+                        help='доля пользователей с начислениями, подавших заявку на вывод')
+    parser.add_argument('--days', type=int, default=365, help='период регистраций')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.alpha <= 2:
+        parser.error('--alpha должен быть больше 2')
+
+    random.seed(args.seed)
+    payouts = load_payouts()
+    levels = max(payouts.REFERRAL_LEVELS)
+    level_cents = {level: round(payouts.REGISTRATION_BONUS * rate * 100) for level, rate in payouts.REFERRAL_LEVELS.items()}
+    level_percentages = {level: round(rate * 100, 2) for level, rate in payouts.REFERRAL_LEVELS.items()}
+
+    timings = {}
+    started = time.perf_counter()
+    parents, depths = build_tree(args.users, args.alpha, args.max_depth, args.root_fraction)
+
+    earned = array('q', bytes(8 * args.users))
+    for i in range(args.users):
+        for level, ancestor in ancestors(parents, i, levels):
+            earned[ancestor] += level_cents[level]
+
+    start_at = datetime.now() - timedelta(days=args.days)
+    step = timedelta(days=args.days) / max(args.users, 1)
+    withdrawals = []
+    balance = array('q', earned)
+    held = array('q', bytes(8 * args.users))
+    for i in range(args.users):
+        if earned[i] and random.random() < args.withdrawal_fraction:
+            amount = random.randint(1, earned[i])
+            status = random.choice(WITHDRAWAL_STATUSES)
+            if status in ('pending', 'approved'):
+                balance[i] -= amount
+                held[i] += amount
+            elif status == 'completed':
+                balance[i] -= amount
+            withdrawals.append((i, amount, status))
+    timings['generate_seconds'] = round(time.perf_counter() - started, 1)
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor()
+    tag = uuid.uuid4().hex[:8]
+    password_hash = hashlib.sha256(b'bench-password').hexdigest()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) + 1000 FROM users")
+    base = cursor.fetchone()[0]
+    cursor.execute("SELECT nextval(pg_get_serial_sequence('withdrawal_requests', 'id'))")
+    first_withdrawal_id = cursor.fetchone()[0]
+    cursor.execute("SELECT setval(pg_get_serial_sequence('withdrawal_requests', 'id'), %s)",
+                   (first_withdrawal_id + max(len(withdrawals), 1) - 1,))
+
+    def registered_at(i: int) -> datetime:
+        return start_at + step * i
+
+    def cents(value: int) -> str:
+        return f'{value // 100}.{value % 100:02d}' if value >= 0 else f'-{-value // 100}.{-value % 100:02d}'
+
+    def user_lines():
+        for i in range(args.users):
+            user_id = base + i
+            code = referral_code_from_id(user_id)
+            referred_by = '\\N' if parents[i] < 0 else str(base + parents[i])
+            yield (f'{user_id}\tgraph-{tag}-{i}@bench.local\t{password_hash}\tuser{i}\t{code}\t{referred_by}\t'
+                   f'{cents(balance[i])}\t{cents(earned[i])}\t{cents(held[i])}\t{registered_at(i)}\n')
+
+    def closure_lines():
+        for i in range(args.users):
+            yield f'{base + i}\t{base + i}\t0\n'
+            for level, ancestor in ancestors(parents, i, levels):
+                yield f'{base + ancestor}\t{base + i}\t{level}\n'
+
+    def earning_lines():
+        for i in range(args.users):
+            created_at = registered_at(i)
+            for level, ancestor in ancestors(parents, i, levels):
+                yield (f'{base + ancestor}\t{base + i}\t{level}\t{cents(level_cents[level])}\t'
+                       f'{level_percentages[level]}\t{created_at}\n')
+
+    def transaction_lines():
+        for i in range(args.users):
+            created_at = registered_at(i)
+            for level, ancestor in ancestors(parents, i, levels):
+                yield (f'{base + ancestor}\treferral\t{cents(level_cents[level])}\t'
+                       f'Реферальный бонус {level} уровня от нового пользователя\t{created_at}\n')
+        for n, (i, amount, status) in enumerate(withdrawals):
+            if status == 'completed':
+                yield (f'{base + i}\twithdrawal\t{cents(-amount)}\tВывод средств #{first_withdrawal_id + n}\t'
+                       f'{registered_at(args.users - 1)}\n')
+
+    def withdrawal_lines():
+        now = registered_at(args.users - 1)
+        for n, (i, amount, status) in enumerate(withdrawals):
+            processed_at = str(now) if status in ('rejected', 'completed') else '\\N'
+            yield (f'{first_withdrawal_id + n}\t{base + i}\t{cents(amount)}\tcard\tgenerated\t{status}\t'
+                   f'{now - timedelta(hours=1)}\t{processed_at}\n')
+
+    copies = (
+        ('users', "users (id, email, password_hash, username, referral_code, referred_by_id, "
+                  "balance, total_earned, held_balance, created_at)", user_lines),
+        ('referral_closure', "referral_closure (ancestor_id, descendant_id, depth)", closure_lines),
+        ('referral_earnings', "referral_earnings (user_id, referred_user_id, level, amount, percentage, created_at)",
+         earning_lines),
+        ('transactions', "transactions (user_id, type, amount, description, created_at)", transaction_lines),
+        ('withdrawal_requests', "withdrawal_requests (id, user_id, amount, payment_method, payment_details, "
+                                "status, created_at, processed_at)", withdrawal_lines),
+    )
+    rows = {}
+    for name, target, lines in copies:
+        copy_started = time.perf_counter()
+        stream = LineStream(lines())
+        cursor.copy_expert(f"COPY {target} FROM STDIN", stream, size=COPY_READ_SIZE)
+        rows[name] = stream.rows
+        timings[f'{name}_seconds'] = round(time.perf_counter() - copy_started, 1)
+
+    stats_started = time.perf_counter()
+    cursor.execute("""
+        INSERT INTO referral_stats (user_id, level, count, earned)
+        SELECT user_id, level, COUNT(*), SUM(amount)
+        FROM referral_earnings
+        WHERE user_id >= %s
+        GROUP BY user_id, level
+    """, (base,))
+    rows['referral_stats'] = cursor.rowcount
+    cursor.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT MAX(id) FROM users))")
+    conn.commit()
+    conn.autocommit = True
+    for table in ('users', 'referral_closure', 'referral_earnings', 'transactions', 'withdrawal_requests',
+                  'referral_stats'):
+        cursor.execute(f"ANALYZE {table}")
+    timings['stats_and_analyze_seconds'] = round(time.perf_counter() - stats_started, 1)
+    cursor.close()
+    conn.close()
+
+    fanout = sorted((c for c in _children_counts(parents) if c), reverse=True)
+    print(json.dumps({
+        'users': args.users,
+        'first_user_id': base,
+        'email_pattern': f'graph-{tag}-<n>@bench.local',
+        'password': 'bench-password',
+        'rows': rows,
+        'total_rows': sum(rows.values()),
+        'max_depth': max(depths) if depths else 0,
+        'top_fanout': fanout[:5],
+        'referrers': len(fanout),
+        'seconds': round(time.perf_counter() - started, 1),
+        'timings': timings,
+    }, indent=2))
+
+
+def _children_counts(parents) -> array:
+    counts = array('i', bytes(4 * len(parents)))
+    for parent in parents:
+        if parent >= 0:
+            counts[parent] += 1
+    return counts
+
+
+if __name__ == '__main__':
+    main()
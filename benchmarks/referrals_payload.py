@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк ответа функции referrals для пользователя с большим числом начислений
+Сравнивает исходные четыре запроса (профиль, GROUP BY по уровням, итоги, 50 последних)
+с одним запросом fetch_stats_payload из backend/referrals/index.py.
+
+Запуск: DATABASE_URL=postgres://... python benchmarks/referrals_payload.py --earnings 100000
+База должна быть одноразовой и с применёнными db_migrations/.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+REFERRALS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'referrals')
+
+
+def load_referrals():
+    sys.path.insert(0, REFERRALS_DIR)
+    spec = importlib.util.spec_from_file_location('referrals_index', os.path.join(REFERRALS_DIR, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def seed(conn, earnings: int) -> int:
+    """Реферер с earnings приглашёнными и по одному начислению за каждого"""
+    cursor = conn.cursor()
+    tag = uuid.uuid4().hex[:8]
+    cursor.execute("""
+        WITH new_id AS (SELECT nextval(pg_get_serial_sequence('users', 'id')) AS id)
+        INSERT INTO users (id, email, password_hash, username, referral_code)
+        SELECT id, %s, 'bench', 'bench', referral_code_from_id(id) FROM new_id
+        RETURNING id
+    """, (f'payload-{tag}@bench.local',))
+    referrer_id = cursor.fetchone()[0]
+    cursor.execute("""
+        WITH new_users AS (
+            INSERT INTO users (id, email, password_hash, username, referral_code, referred_by_id)
+            SELECT id, 'payload-' || %(tag)s || '-' || id || '@bench.local', 'bench', 'bench',
+                   referral_code_from_id(id), %(referrer_id)s
+            FROM (SELECT nextval(pg_get_serial_sequence('users', 'id')) AS id FROM generate_series(1, %(n)s)) ids
+            RETURNING id
+        )
+        INSERT INTO referral_earnings (user_id, referred_user_id, level, amount, percentage, created_at)
+        SELECT %(referrer_id)s, id, 1 + id %% 5, 1.00, 1.00,
+               CURRENT_TIMESTAMP - random() * INTERVAL '365 days'
+        FROM new_users
+    """, {'tag': tag, 'referrer_id': referrer_id, 'n': earnings})
+    cursor.execute("""
+        INSERT INTO referral_stats (user_id, level, count, earned)
+        SELECT user_id, level, COUNT(DISTINCT referred_user_id), SUM(amount)
+        FROM referral_earnings
+        WHERE user_id = %s
+        GROUP BY user_id, level
+    """, (referrer_id,))
+    cursor.execute("ANALYZE users")
+    cursor.execute("ANALYZE referral_earnings")
+    conn.commit()
+    cursor.close()
+    return referrer_id
+
+
+def four_queries(cursor, user_id):
+    """Исходная последовательность запросов функции referrals"""
+    cursor.execute("""
+        SELECT id, email, username, referral_code, balance, total_earned
+        FROM users WHERE id = %s
+    """, (user_id,))
+    cursor.fetchone()
+    cursor.execute("""
+        SELECT level, COUNT(DISTINCT referred_user_id) as count, SUM(amount) as total_earned
+        FROM referral_earnings
+        WHERE user_id = %s
+        GROUP BY level
+        ORDER BY level
+    """, (user_id,))
+    cursor.fetchall()
+    cursor.execute("""
+        SELECT COUNT(DISTINCT referred_user_id) as total_referrals,
+               SUM(amount) as total_referral_earnings
+        FROM referral_earnings
+        WHERE user_id = %s
+    """, (user_id,))
+    cursor.fetchone()
+    cursor.execute("""
+        SELECT u.id, u.username, u.email, re.level, re.amount, re.created_at
+        FROM referral_earnings re
+        JOIN users u ON re.referred_user_id = u.id
+        WHERE re.user_id = %s
+        ORDER BY re.created_at DESC
+        LIMIT 50
+    """, (user_id,))
+    cursor.fetchall()
+
+
+def measure(conn, fetch, user_id, iterations: int) -> dict:
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    fetch(cursor, user_id)
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fetch(cursor, user_id)
+        timings.append((time.perf_counter() - started) * 1000)
+        conn.rollback()
+    cursor.close()
+    timings.sort()
+    return {
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(timings[len(timings) // 2], 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95)], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--earnings', type=int, default=100_000)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    referrals = load_referrals()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    user_id = seed(conn, args.earnings)
+
+    result = {
+        'user_id': user_id,
+        'earnings_rows': args.earnings,
+        'four_queries': measure(conn, four_queries, user_id, args.iterations),
+        'single_payload_query': measure(conn, referrals.fetch_stats_payload, user_id, args.iterations),
+    }
+    conn.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
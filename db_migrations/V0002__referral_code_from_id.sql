@@ -0,0 +1,16 @@
+-- Реферальный код как биекция id пользователя: уникален без проверочных запросов.
+-- Умножение на число, взаимно простое с 36^7, переставляет коды, чтобы соседние id
+-- не давали похожих кодов. Длина 7 символов не пересекается со старыми 8-символьными кодами.
+CREATE OR REPLACE FUNCTION referral_code_from_id(user_id BIGINT) RETURNS VARCHAR AS $$
+DECLARE
+    alphabet CONSTANT TEXT := 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789';
+    n BIGINT := (user_id * 1580030173 + 29943717) % 78364164096;
+    code TEXT := '';
+BEGIN
+    FOR i IN 1..7 LOOP
+        code := substr(alphabet, (n % 36)::INT + 1, 1) || code;
+        n := n / 36;
+    END LOOP;
+    RETURN code;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
@@ -0,0 +1,14 @@
+-- Очередь событий регистрации: реферальные начисления выполняются отдельным обработчиком
+CREATE TABLE IF NOT EXISTS referral_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    event_type VARCHAR(50) NOT NULL DEFAULT 'user_registered',
+    user_id INTEGER NOT NULL,
+    referred_by_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_referral_outbox_pending ON referral_outbox(id) WHERE processed_at IS NULL;
+
+-- Одно начисление на уровень за каждого приглашённого: повторная обработка события ничего не удвоит
+CREATE UNIQUE INDEX IF NOT EXISTS idx_referral_earnings_referred_level ON referral_earnings(referred_user_id, level);
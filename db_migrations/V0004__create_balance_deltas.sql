@@ -0,0 +1,52 @@
+-- Отложенные изменения балансов: начисления добавляются строками без блокировки users,
+-- а периодически сворачиваются в users.balance / users.total_earned
+CREATE TABLE IF NOT EXISTS balance_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    balance_delta DECIMAL(10, 2) NOT NULL,
+    earned_delta DECIMAL(10, 2) NOT NULL DEFAULT 0.00,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_balance_deltas_user ON balance_deltas(user_id);
+
+-- Баланс с учётом ещё не свёрнутых изменений
+CREATE OR REPLACE VIEW user_balances AS
+SELECT
+    u.id AS user_id,
+    u.balance + COALESCE(d.balance_delta, 0) AS balance,
+    u.total_earned + COALESCE(d.earned_delta, 0) AS total_earned
+FROM users u
+LEFT JOIN LATERAL (
+    SELECT SUM(balance_delta) AS balance_delta, SUM(earned_delta) AS earned_delta
+    FROM balance_deltas
+    WHERE balance_deltas.user_id = u.id
+) d ON TRUE;
+
+-- Свернуть изменения одного пользователя или всех (NULL); возвращает число обновлённых строк users
+CREATE OR REPLACE FUNCTION fold_balance_deltas(p_user_id INTEGER DEFAULT NULL) RETURNS INTEGER AS $$
+DECLARE
+    folded INTEGER;
+BEGIN
+    WITH moved AS (
+        DELETE FROM balance_deltas
+        WHERE p_user_id IS NULL OR user_id = p_user_id
+        RETURNING user_id, balance_delta, earned_delta
+    ),
+    totals AS (
+        SELECT user_id, SUM(balance_delta) AS balance_delta, SUM(earned_delta) AS earned_delta
+        FROM moved
+        GROUP BY user_id
+    ),
+    applied AS (
+        UPDATE users
+        SET balance = users.balance + totals.balance_delta,
+            total_earned = users.total_earned + totals.earned_delta
+        FROM totals
+        WHERE users.id = totals.user_id
+        RETURNING users.id
+    )
+    SELECT COUNT(*) INTO folded FROM applied;
+    RETURN folded;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,15 @@
+-- Сводка рефералов по уровням, обновляется вместе с начислениями
+CREATE TABLE IF NOT EXISTS referral_stats (
+    user_id INTEGER NOT NULL,
+    level INTEGER NOT NULL CHECK (level >= 1 AND level <= 5),
+    count INTEGER NOT NULL DEFAULT 0,
+    earned DECIMAL(12, 2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (user_id, level)
+);
+
+-- Заполнение по уже существующим начислениям
+INSERT INTO referral_stats (user_id, level, count, earned)
+SELECT user_id, level, COUNT(DISTINCT referred_user_id), SUM(amount)
+FROM referral_earnings
+GROUP BY user_id, level
+ON CONFLICT (user_id, level) DO NOTHING;
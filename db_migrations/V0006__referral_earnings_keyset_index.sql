@@ -0,0 +1,4 @@
+-- Постраничная выдача последних рефералов по ключу (created_at, id) без сортировки всех начислений
+CREATE INDEX IF NOT EXISTS idx_referral_earnings_user_created
+    ON referral_earnings(user_id, created_at DESC, id DESC)
+    INCLUDE (referred_user_id, level, amount);
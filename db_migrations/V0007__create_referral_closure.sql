@@ -0,0 +1,26 @@
+-- Таблица замыкания реферального дерева: все пары (предок, потомок) на глубине до 5.
+-- Строка глубины 0 (пользователь сам себе предок) упрощает добавление нового пользователя.
+CREATE TABLE IF NOT EXISTS referral_closure (
+    ancestor_id INTEGER NOT NULL,
+    descendant_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL CHECK (depth >= 0 AND depth <= 5),
+    PRIMARY KEY (ancestor_id, depth, descendant_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_referral_closure_descendant
+    ON referral_closure(descendant_id, depth)
+    INCLUDE (ancestor_id);
+
+-- Заполнение по существующим пользователям
+INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE walk AS (
+    SELECT id AS descendant_id, id AS ancestor_id, referred_by_id, 0 AS depth
+    FROM users
+    UNION ALL
+    SELECT walk.descendant_id, u.id, u.referred_by_id, walk.depth + 1
+    FROM walk
+    JOIN users u ON u.id = walk.referred_by_id
+    WHERE walk.depth < 5
+)
+SELECT ancestor_id, descendant_id, depth FROM walk
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,11 @@
+-- Постраничная выдача заявок по вкладкам статусов, по пользователю и без фильтра
+CREATE INDEX IF NOT EXISTS idx_withdrawal_requests_status_created
+    ON withdrawal_requests(status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_withdrawal_requests_user_created
+    ON withdrawal_requests(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_withdrawal_requests_created
+    ON withdrawal_requests(created_at DESC, id DESC);
+
+-- Заменены составными индексами выше
+DROP INDEX IF EXISTS idx_withdrawal_requests_status;
+DROP INDEX IF EXISTS idx_withdrawal_requests_user;
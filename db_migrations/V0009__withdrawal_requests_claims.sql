@@ -0,0 +1,4 @@
+-- Аренда заявок админом или обработчиком выплат: пока claimed_until не истёк,
+-- другие исполнители заявку не получают и не могут её обработать
+ALTER TABLE withdrawal_requests ADD COLUMN IF NOT EXISTS claimed_by INTEGER;
+ALTER TABLE withdrawal_requests ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP;
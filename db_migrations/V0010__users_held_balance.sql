@@ -0,0 +1,28 @@
+-- Средства открытых заявок на вывод (pending, approved) резервируются в held_balance:
+-- balance - доступно для новых заявок, held_balance - ждёт выплаты
+ALTER TABLE users ADD COLUMN IF NOT EXISTS held_balance DECIMAL(10, 2) DEFAULT 0.00;
+
+-- Резерв под уже открытые заявки
+UPDATE users
+SET balance = users.balance - open_requests.amount,
+    held_balance = users.held_balance + open_requests.amount
+FROM (
+    SELECT user_id, SUM(amount) AS amount
+    FROM withdrawal_requests
+    WHERE status IN ('pending', 'approved')
+    GROUP BY user_id
+) open_requests
+WHERE users.id = open_requests.user_id;
+
+CREATE OR REPLACE VIEW user_balances AS
+SELECT
+    u.id AS user_id,
+    u.balance + COALESCE(d.balance_delta, 0) AS balance,
+    u.total_earned + COALESCE(d.earned_delta, 0) AS total_earned,
+    u.held_balance
+FROM users u
+LEFT JOIN LATERAL (
+    SELECT SUM(balance_delta) AS balance_delta, SUM(earned_delta) AS earned_delta
+    FROM balance_deltas
+    WHERE balance_deltas.user_id = u.id
+) d ON TRUE;
@@ -0,0 +1,12 @@
+-- Снимки ответов на POST-запросы с заголовком Idempotency-Key: повтор возвращает сохранённый ответ
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(320) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    status_code INTEGER,
+    body TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
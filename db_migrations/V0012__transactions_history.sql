@@ -0,0 +1,52 @@
+-- История транзакций пользователя: постраничная выдача по (created_at, id)
+-- и баланс после каждой операции, чтобы клиенту не пересчитывать журнал с начала
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS balance_after DECIMAL(12, 2);
+
+CREATE INDEX IF NOT EXISTS idx_transactions_user_created
+    ON transactions(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_transactions_balance_missing
+    ON transactions(user_id, created_at, id)
+    WHERE balance_after IS NULL;
+
+-- Заменён составным индексом выше
+DROP INDEX IF EXISTS idx_transactions_user;
+
+-- Досчитать balance_after пользователю, начиная с самой ранней строки без него.
+-- Строки пишутся без блокировки пользователя (пакетные начисления), поэтому баланс
+-- вычисляется при чтении и только для хвоста журнала; возвращает число обновлённых строк.
+CREATE OR REPLACE FUNCTION fill_transaction_balances(p_user_id INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    first_created_at TIMESTAMP;
+    first_id INTEGER;
+    base NUMERIC;
+    filled INTEGER;
+BEGIN
+    SELECT created_at, id INTO first_created_at, first_id
+    FROM transactions
+    WHERE user_id = p_user_id AND balance_after IS NULL
+    ORDER BY created_at, id
+    LIMIT 1;
+
+    IF first_id IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    SELECT balance_after INTO base
+    FROM transactions
+    WHERE user_id = p_user_id AND (created_at, id) < (first_created_at, first_id)
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1;
+
+    UPDATE transactions t
+    SET balance_after = s.running
+    FROM (
+        SELECT id, COALESCE(base, 0) + SUM(amount) OVER (ORDER BY created_at, id) AS running
+        FROM transactions
+        WHERE user_id = p_user_id AND (created_at, id) >= (first_created_at, first_id)
+    ) s
+    WHERE t.id = s.id AND t.balance_after IS DISTINCT FROM s.running;
+
+    GET DIAGNOSTICS filled = ROW_COUNT;
+    RETURN filled;
+END;
+$$ LANGUAGE plpgsql;
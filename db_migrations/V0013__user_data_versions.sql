@@ -0,0 +1,73 @@
+-- Счётчик изменений данных пользователя для ETag: функции referrals и withdrawals
+-- отвечают 304 по одной выборке по первичному ключу, не выполняя агрегаты.
+-- Счётчик хранится отдельно от users и без внешнего ключа на неё: триггеры пакетных
+-- начислений не блокируют строки users получателей, поэтому параллельные выплаты
+-- и заявки на вывод не ждут друг друга на строках самых активных рефереров
+CREATE TABLE IF NOT EXISTS user_data_versions (
+    user_id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- Увеличить версию всем пользователям, чьи строки изменил оператор. Триггеры уровня
+-- оператора с таблицами переходов: пакетное начисление поднимает версию каждого получателя
+-- один раз на оператор; вставка идёт в порядке user_id, чтобы не было взаимоблокировок
+CREATE OR REPLACE FUNCTION bump_user_data_version() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO user_data_versions (user_id, version)
+        SELECT DISTINCT user_id, 1 FROM old_rows ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET version = user_data_versions.version + 1;
+    ELSE
+        INSERT INTO user_data_versions (user_id, version)
+        SELECT DISTINCT user_id, 1 FROM new_rows ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET version = user_data_versions.version + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Таблицы переходов допускают только одно событие на триггер
+DROP TRIGGER IF EXISTS referral_earnings_version_insert ON referral_earnings;
+CREATE TRIGGER referral_earnings_version_insert
+    AFTER INSERT ON referral_earnings
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version();
+DROP TRIGGER IF EXISTS referral_earnings_version_update ON referral_earnings;
+CREATE TRIGGER referral_earnings_version_update
+    AFTER UPDATE ON referral_earnings
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version();
+DROP TRIGGER IF EXISTS referral_earnings_version_delete ON referral_earnings;
+CREATE TRIGGER referral_earnings_version_delete
+    AFTER DELETE ON referral_earnings
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version();
+
+-- UPDATE транзакций не отслеживается: его делает только fill_transaction_balances,
+-- досчитывающая balance_after при чтении истории, и видимые данные он не меняет
+DROP TRIGGER IF EXISTS transactions_version_insert ON transactions;
+CREATE TRIGGER transactions_version_insert
+    AFTER INSERT ON transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version();
+DROP TRIGGER IF EXISTS transactions_version_delete ON transactions;
+CREATE TRIGGER transactions_version_delete
+    AFTER DELETE ON transactions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version();
+
+DROP TRIGGER IF EXISTS withdrawal_requests_version_insert ON withdrawal_requests;
+CREATE TRIGGER withdrawal_requests_version_insert
+    AFTER INSERT ON withdrawal_requests
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version();
+DROP TRIGGER IF EXISTS withdrawal_requests_version_update ON withdrawal_requests;
+CREATE TRIGGER withdrawal_requests_version_update
+    AFTER UPDATE ON withdrawal_requests
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version();
+DROP TRIGGER IF EXISTS withdrawal_requests_version_delete ON withdrawal_requests;
+CREATE TRIGGER withdrawal_requests_version_delete
+    AFTER DELETE ON withdrawal_requests
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version();
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
+import { Tabs, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import { Textarea } from '@/components/ui/textarea';
 import { useToast } from '@/hooks/use-toast';
 import Icon from '@/components/ui/icon';
@@ -15,6 +16,14 @@ import {
 
 const WITHDRAWALS_API = 'https://functions.poehali.dev/c3d3ef57-3cb0-4ed9-a0b6-41ecbde6c6e9';
 
+const STATUS_TABS = [
+  { value: 'pending', label: 'На рассмотрении' },
+  { value: 'approved', label: 'Одобрено' },
+  { value: 'completed', label: 'Выполнено' },
+  { value: 'rejected', label: 'Отклонено' },
+  { value: 'all', label: 'Все' },
+];
+
 interface User {
   id: number;
   is_admin: boolean;
@@ -38,7 +47,10 @@ export default function Admin() {
   const { toast } = useToast();
   const [user, setUser] = useState<User | null>(null);
   const [requests, setRequests] = useState<WithdrawalRequest[]>([]);
+  const [statusFilter, setStatusFilter] = useState('pending');
+  const [nextBefore, setNextBefore] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedRequest, setSelectedRequest] = useState<WithdrawalRequest | null>(null);
   const [adminComment, setAdminComment] = useState('');
   const [processing, setProcessing] = useState(false);
@@ -62,25 +74,41 @@ export default function Admin() {
     }
     
     setUser(userData);
-    fetchRequests(userData.id);
   }, [navigate, toast]);
 
-  const fetchRequests = async (userId: number) => {
+  useEffect(() => {
+    if (user) {
+      fetchRequests();
+    }
+  }, [user, statusFilter]);
+
+  const fetchRequests = async (before?: string) => {
+    const params = new URLSearchParams();
+    if (statusFilter !== 'all') {
+      params.set('status', statusFilter);
+    }
+    if (before) {
+      params.set('before', before);
+      setLoadingMore(true);
+    }
+
     try {
-      const response = await fetch(WITHDRAWALS_API, {
+      const response = await fetch(`${WITHDRAWALS_API}?${params}`, {
         headers: {
-          'X-User-Id': userId.toString(),
+          'X-Auth-Token': localStorage.getItem('token') || '',
         },
       });
 
       const data = await response.json();
       if (response.ok) {
-        setRequests(data.requests);
+        setRequests(prev => (before ? [...prev, ...data.requests] : data.requests));
+        setNextBefore(data.next_before);
       }
     } catch (error) {
       console.error('Error fetching requests:', error);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -94,7 +122,7 @@ export default function Admin() {
         method: 'PUT',
         headers: {
           'Content-Type': 'application/json',
-          'X-User-Id': user.id.toString(),
+          'X-Auth-Token': localStorage.getItem('token') || '',
         },
         body: JSON.stringify({
           request_id: requestId,
@@ -110,7 +138,7 @@ export default function Admin() {
           title: 'Статус обновлён!',
           description: data.message,
         });
-        fetchRequests(user.id);
+        fetchRequests();
         setSelectedRequest(null);
         setAdminComment('');
       } else {
@@ -163,9 +191,6 @@ export default function Admin() {
 
   if (!user) return null;
 
-  const pendingCount = requests.filter(r => r.status === 'pending').length;
-  const approvedCount = requests.filter(r => r.status === 'approved').length;
-
   return (
     <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-100">
       <div className="container mx-auto p-4 max-w-7xl">
@@ -183,43 +208,26 @@ export default function Admin() {
           </Button>
         </div>
 
-        <div className="grid gap-4 md:grid-cols-3 mb-6">
-          <Card>
-            <CardHeader className="pb-3">
-              <CardTitle className="text-sm font-medium text-gray-600">На рассмотрении</CardTitle>
-            </CardHeader>
-            <CardContent>
-              <div className="text-3xl font-bold text-yellow-600">{pendingCount}</div>
-            </CardContent>
-          </Card>
-
-          <Card>
-            <CardHeader className="pb-3">
-              <CardTitle className="text-sm font-medium text-gray-600">Одобрено</CardTitle>
-            </CardHeader>
-            <CardContent>
-              <div className="text-3xl font-bold text-blue-600">{approvedCount}</div>
-            </CardContent>
-          </Card>
-
-          <Card>
-            <CardHeader className="pb-3">
-              <CardTitle className="text-sm font-medium text-gray-600">Всего заявок</CardTitle>
-            </CardHeader>
-            <CardContent>
-              <div className="text-3xl font-bold text-purple-600">{requests.length}</div>
-            </CardContent>
-          </Card>
-        </div>
-
         <Card>
           <CardHeader>
-            <CardTitle>Все заявки на вывод</CardTitle>
-            <CardDescription>Обработка запросов пользователей</CardDescription>
+            <CardTitle>Заявки на вывод</CardTitle>
+            <CardDescription>
+              Обработка запросов пользователей · показано {requests.length}{nextBefore ? '+' : ''}
+            </CardDescription>
           </CardHeader>
           <CardContent>
+            <Tabs value={statusFilter} onValueChange={setStatusFilter} className="mb-4">
+              <TabsList className="flex-wrap h-auto">
+                {STATUS_TABS.map(tab => (
+                  <TabsTrigger key={tab.value} value={tab.value}>
+                    {tab.label}
+                  </TabsTrigger>
+                ))}
+              </TabsList>
+            </Tabs>
+
             {requests.length === 0 ? (
-              <p className="text-center text-gray-500 py-8">Заявок пока нет</p>
+              <p className="text-center text-gray-500 py-8">Заявок нет</p>
             ) : (
               <div className="space-y-3">
                 {requests.map((req) => (
@@ -287,6 +295,19 @@ export default function Admin() {
                     )}
                   </div>
                 ))}
+
+                {nextBefore && (
+                  <div className="flex justify-center pt-2">
+                    <Button variant="outline" onClick={() => fetchRequests(nextBefore)} disabled={loadingMore}>
+                      {loadingMore ? (
+                        <Icon name="Loader2" className="mr-2 animate-spin" size={16} />
+                      ) : (
+                        <Icon name="ChevronDown" className="mr-2" size={16} />
+                      )}
+                      Загрузить ещё
+                    </Button>
+                  </div>
+                )}
               </div>
             )}
           </CardContent>
@@ -7,6 +7,7 @@ import Icon from '@/components/ui/icon';
 import { Input } from '@/components/ui/input';
 
 const REFERRALS_API = 'https://functions.poehali.dev/36b5a91a-1e7c-484b-9638-a160fdcb71f6';
+const AUTH_API = 'https://functions.poehali.dev/6b3ec691-bb0c-4a00-9d2e-905c4465e7dd';
 const BASE_URL = window.location.origin;
 
 interface User {
@@ -54,14 +55,14 @@ export default function Dashboard() {
     
     const userData = JSON.parse(userStr);
     setUser(userData);
-    fetchStats(userData.id);
+    fetchStats();
   }, [navigate]);
 
-  const fetchStats = async (userId: number) => {
+  const fetchStats = async () => {
     try {
       const response = await fetch(REFERRALS_API, {
         headers: {
-          'X-User-Id': userId.toString(),
+          'X-Auth-Token': localStorage.getItem('token') || '',
         },
       });
 
@@ -78,6 +79,17 @@ export default function Dashboard() {
   };
 
   const handleLogout = () => {
+    const token = localStorage.getItem('token');
+    if (token) {
+      fetch(AUTH_API, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'X-Auth-Token': token,
+        },
+        body: JSON.stringify({ action: 'logout' }),
+      }).catch((error) => console.error('Error logging out:', error));
+    }
     localStorage.removeItem('token');
     localStorage.removeItem('user');
     navigate('/login');
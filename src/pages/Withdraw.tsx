@@ -9,6 +9,7 @@ import { useToast } from '@/hooks/use-toast';
 import Icon from '@/components/ui/icon';
 
 const WITHDRAWALS_API = 'https://functions.poehali.dev/c3d3ef57-3cb0-4ed9-a0b6-41ecbde6c6e9';
+const REFERRALS_API = 'https://functions.poehali.dev/36b5a91a-1e7c-484b-9638-a160fdcb71f6';
 
 interface User {
   id: number;
@@ -47,21 +48,20 @@ export default function Withdraw() {
   }, [navigate]);
 
   const fetchRequests = async () => {
-    const userStr = localStorage.getItem('user');
-    if (!userStr) return;
-    
-    const userData = JSON.parse(userStr);
+    const token = localStorage.getItem('token');
+    if (!token) return;
     
     try {
-      const response = await fetch(WITHDRAWALS_API, {
+      const response = await fetch(`${REFERRALS_API}?action=bundle`, {
         headers: {
-          'X-User-Id': userData.id.toString(),
+          'X-Auth-Token': token,
         },
       });
 
       const data = await response.json();
       if (response.ok) {
-        setRequests(data.requests);
+        setRequests(data.withdrawal_requests);
+        setUser((current) => (current ? { ...current, balance: data.user.balance } : current));
       }
     } catch (error) {
       console.error('Error fetching requests:', error);
@@ -89,7 +89,7 @@ export default function Withdraw() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          'X-User-Id': user.id.toString(),
+          'X-Auth-Token': localStorage.getItem('token') || '',
         },
         body: JSON.stringify({
           amount: amountNum,